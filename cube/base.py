@@ -20,14 +20,20 @@
 """
 import copy
 
+from memo import get_memo, memoized
+
 class BaseDimension(object):
     """
     The base class for a dimension of a cube.
 
     Kwargs:
         sample_space (iterable|callable): The sample space of the dimension to create.
+
+    The dimensions declared on a cube class are only definitions, that are never constrained. A cube gives access to copies of these definitions, bound to the cube's constraint (see :meth:`BaseCube.dimensions`).
     """
 
+    __slots__ = ('_name', 'sample_space', '_constraint')
+
     def __init__(self, sample_space=[]):
         self._name = ""
         self.sample_space = sample_space
@@ -45,20 +51,10 @@ class BaseDimension(object):
     def constraint(self):
         """
         Returns:
-            object. The value to which the dimension is constrained
+            object. The value to which the dimension is constrained. It is read-only : a constrained dimension is obtained from a constrained cube (see :meth:`BaseCube.constrain`).
         """
         return self._constraint
 
-    @constraint.setter
-    def constraint(self, value):
-        """
-        Setter for the property :meth:`constraint`.
-
-        Args:
-            value (object): The value to set the dimension's constraint to.
-        """
-        self._constraint = value
-
     @property
     def pretty_constraint(self):
         """
@@ -67,6 +63,22 @@ class BaseDimension(object):
         """
         return self.constraint
 
+    def pretty_constraints(self, values):
+        """
+        Returns:
+            list. The :meth:`pretty_constraint` of the dimension constrained to each value of *values*, in the same order. Override this method to get all the labels at once, for example with one query, instead of one :meth:`pretty_constraint` per value.
+        """
+        return [self._bind(value).pretty_constraint for value in values]
+
+    def _bind(self, constraint):
+        """
+        Returns:
+            BaseDimension. A copy of the dimension, constrained to *constraint*.
+        """
+        dimension = copy.copy(self)
+        dimension._constraint = constraint
+        return dimension
+
     def get_sample_space(self, sort=False):
         """
         Kwargs:
@@ -81,6 +93,13 @@ class BaseDimension(object):
         else:
             return sample_space
 
+    def iter_sample_space(self):
+        """
+        Returns:
+            iterator. An iterator on the sample space of the dimension, not sorted.
+        """
+        return iter(self.get_sample_space())
+
     def _sort_sample_space(self, sample_space):
         """
         Args:
@@ -97,6 +116,8 @@ class BaseCubeOptions(object):
     """
     def __init__(self, options):
         self.dimensions = None
+        self.dim_names = ()
+        self.dim_indexes = {}
 
 class BaseCubeMetaclass(type):
     """
@@ -132,29 +153,87 @@ class BaseCubeMetaclass(type):
         parent_dimensions.update(dimensions)
         dimensions = parent_dimensions
         new_class._meta.dimensions = dimensions
+        #the constraint of a cube is a tuple of values, in the order of *dim_names*
+        new_class._meta.dim_names = tuple(sorted(dimensions))
+        new_class._meta.dim_indexes = dict([(dim_name, index) for index, dim_name in enumerate(new_class._meta.dim_names)])
 
         return new_class
         
 class BaseCube(object):
     """
     The base class for a cube.
+
+    A cube only stores its constraint, as a tuple of values. The dimensions of the cube are bound to this constraint only when they are accessed.
+
+    Cubes are hashable : two cubes are equal if they are of the same class, have the same :meth:`_fingerprint` and the same :meth:`constraint_key`. Cubes can therefore be used as keys for caching measures.
+
+    .. note:: The cube classes of the library use *__slots__*, so that a subcube has no *__dict__*. A subclass keeps this saving by declaring its own *__slots__* (empty, or with its extra instance attributes), otherwise its instances have a *__dict__* as usual.
     
     .. todo:: clarify get_sample_space and sorting
     """
 
     __metaclass__ = BaseCubeMetaclass
+    __slots__ = ('_constraint', '_constraint_key', '_dimensions')
 
     def __new__(cls, *args, **kwargs):
         """
-        Provides the instance with local copies of the dimensions declared at the class level.
+        Provides the instance with an empty constraint.
         """
         new_cube = super(BaseCube, cls).__new__(cls)
-        
-        #overrides the dimensions from the class with local copies
-        new_cube.dimensions = copy.deepcopy(cls._meta.dimensions)
-        
+        new_cube._constraint = (None,) * len(cls._meta.dim_names)
+        new_cube._constraint_key = None
+        #the bound dimensions, only created by :meth:`_bound_dimension`, so that a subcube stays small
+        new_cube._dimensions = None
         return new_cube
-    
+
+    def __copy__(self):
+        """
+        Returns:
+            BaseCube. A shallow copy of the cube. The pickling of a cube (see :meth:`cube.models.Cube.__reduce__`) is not used, so that the copy shares its attributes with the cube.
+        """
+        cube_copy = type(self).__new__(type(self))
+        for cube_class in type(self).__mro__:
+            slots = cube_class.__dict__.get('__slots__', ())
+            if isinstance(slots, basestring):
+                slots = (slots,)
+            for slot in slots:
+                if slot not in ('__dict__', '__weakref__') and hasattr(self, slot):
+                    setattr(cube_copy, slot, getattr(self, slot))
+        if hasattr(self, '__dict__'):
+            cube_copy.__dict__.update(self.__dict__)
+        #the copy binds its dimensions in its own dictionnary
+        if self._dimensions is not None:
+            cube_copy._dimensions = dict(self._dimensions)
+        return cube_copy
+
+    @property
+    def dimensions(self):
+        """
+        Returns:
+            dict. A dictionnary of pairs *(dimension_name, dimension)*, where the dimensions are bound to the cube's constraint.
+        """
+        return dict([(dim_name, self._bound_dimension(dim_name)) for dim_name in self._meta.dim_names])
+
+    def _bound_dimension(self, dim_name):
+        """
+        Returns:
+            BaseDimension. The dimension *dim_name*, bound to the cube's constraint. A cube can be shared by several threads : two threads binding the same dimension at once can get two copies of it, which is harmless as bound dimensions are immutable.
+        """
+        dimensions = self._dimensions
+        if dimensions is None:
+            dimensions = self._dimensions = {}
+        try:
+            return dimensions[dim_name]
+        except KeyError:
+            return dimensions.setdefault(dim_name, self._bind_dimension(dim_name))
+
+    def _bind_dimension(self, dim_name):
+        """
+        Returns:
+            BaseDimension. A new copy of the dimension *dim_name*, bound to the cube's constraint.
+        """
+        return self._meta.dimensions[dim_name]._bind(self._constraint[self._meta.dim_indexes[dim_name]])
+
     @staticmethod
     def sort_key(coordinates):
         """
@@ -190,30 +269,67 @@ class BaseCube(object):
 
         .. note:: If one of the dimensions whose name passed as parameter is already constrained in the calling cube, it is not considered as an error.
         """
+        free_dim_names = self._free_dim_names(*dim_names)
+
+        #if no free dimension, the cube is completely constrained, no need to get further
+        if not free_dim_names:
+            yield self.constrain()
+            raise StopIteration
+
+        #else, we get the cube's sorted sample space, and yield the subcubes
+        for value in self._iter_sorted_sample_space(*free_dim_names):
+            yield self.constrain(**value)
+        raise StopIteration
+
+    def _free_dim_names(self, *dim_names):
+        """
+        Returns:
+            list. The sublist of *dim_names*, with only dimensions that are not yet constrained.
+        """
         dim_names = list(dim_names)
-        #sublist of *dim_names*, with only dimensions that are not yet constrained
         free_dim_names = []
         free_dim_name = self._pop_first_dim(dim_names, free_only=True)
         while (free_dim_name):
             free_dim_names.append(free_dim_name)
             free_dim_name = self._pop_first_dim(dim_names, free_only=True)
+        return free_dim_names
 
-        #if no free dimension, the cube is completely constrained, no need to get further
-        if not free_dim_names:
-            yield copy.deepcopy(self)
-            raise StopIteration
-
-        #else, we get and sort the cube's sample space
-        sample_space = self.get_sample_space(*free_dim_names)
+    def _sorted_sample_space(self, *dim_names):
+        """
+        Returns:
+            list. The sample space for the cube for the dimensions *dim_names*, in the format 'dict', and sorted according to :meth:`sort_key`.
+        """
+        sample_space = self.get_sample_space(*dim_names)
         try:
             sample_space = sorted(sample_space, key=self.sort_key)
         except NotImplementedError:
             pass
+        return sample_space
 
-        #and yield the subcubes
-        for value in sample_space:
-            yield self.constrain(**value)
-        raise StopIteration
+    def _iter_sorted_sample_space(self, *dim_names):
+        """
+        Returns:
+            iterator. The same sample space as :meth:`_sorted_sample_space`. If the cube doesn't define :meth:`sort_key`, the sample space is not sorted again, and it is taken lazily with :meth:`_iter_sample_space`.
+        """
+        if type(self).sort_key is not BaseCube.sort_key:
+            return iter(self._sorted_sample_space(*dim_names))
+        return self._iter_sample_space(*dim_names)
+
+    def _iter_sample_space(self, *dim_names):
+        """
+        Returns:
+            iterator. The same sample space as :meth:`get_sample_space` for the dimensions *dim_names*, in the format 'dict'. The values of the first dimension are streamed (see :meth:`BaseDimension.iter_sample_space`) : only the sample space of the other dimensions is kept in memory.
+        """
+        dim_names = list(dim_names)
+        dim_name = self._pop_first_dim(dim_names)
+        if not dim_name:
+            return
+        other_sample_space = self.get_sample_space(*dim_names) if dim_names else [{}]
+        for value in self._iter_dimension_sample_space(dim_name):
+            for other_value in other_sample_space:
+                coordinates = {dim_name: value}
+                coordinates.update(other_value)
+                yield coordinates
 
     def constrain(self, **extra_constraint):
         """
@@ -228,15 +344,17 @@ class BaseCube(object):
         Returns:
             Cube. A copy of the calling cube, with the updated constraint.
         """
-        cube_copy = copy.deepcopy(self)
-        dimensions = cube_copy.dimensions
-
+        constraint = list(self._constraint)
         for dim_name, value in extra_constraint.iteritems():
             try:
-                dimensions[dim_name].constraint = value
+                constraint[self._meta.dim_indexes[dim_name]] = value
             except KeyError:
                 raise ValueError("invalid dimension %s" % dim_name)
-        
+
+        cube_copy = copy.copy(self)
+        cube_copy._constraint = tuple(constraint)
+        cube_copy._constraint_key = None
+        cube_copy._dimensions = None
         return cube_copy
 
     def measure(self, **coordinates):
@@ -278,7 +396,7 @@ class BaseCube(object):
             new_sample_space = []
             if sample_space:
                 for old_value in sample_space:
-                    for extra_value in self.dimensions[dim_name].get_sample_space():
+                    for extra_value in self._dimension_sample_space(dim_name):
                         if format == 'dict':
                             new_value = dict(old_value)
                             new_value.update({dim_name: extra_value})
@@ -288,25 +406,83 @@ class BaseCube(object):
                 sample_space = new_sample_space
             else:
                 if format == 'dict':
-                    sample_space = [{dim_name: value} for value in self.dimensions[dim_name].get_sample_space()]
+                    sample_space = [{dim_name: value} for value in self._dimension_sample_space(dim_name)]
                 elif format == 'tuple':
-                    sample_space = [(value,) for value in self.dimensions[dim_name].get_sample_space()]
+                    sample_space = [(value,) for value in self._dimension_sample_space(dim_name)]
                 elif format == 'flat':
-                    sample_space = list(self.dimensions[dim_name].get_sample_space())
+                    sample_space = list(self._dimension_sample_space(dim_name))
             dim_name = self._pop_first_dim(dim_names)
         return sample_space
 
+    def _dimension_sample_space(self, dim_name):
+        """
+        Returns:
+            iterable. The sample space of the dimension *dim_name* bound to the cube. The sample space of a free dimension doesn't depend on the cube's constraint, so it is memoized for all the cubes with the same class and :meth:`_fingerprint` (see :mod:`cube.memo`).
+        """
+        dimension = self._bound_dimension(dim_name)
+        if dimension.constraint:
+            return dimension.get_sample_space()
+        key = ('sample_space', type(self), self._fingerprint(), dim_name)
+        return memoized(key, lambda: list(dimension.get_sample_space()))
+
+    def _iter_dimension_sample_space(self, dim_name):
+        """
+        Returns:
+            iterator. The same sample space as :meth:`_dimension_sample_space`. If the memo is active, the sample space is memoized as a list. Otherwise, it is streamed.
+        """
+        if get_memo() is not None:
+            return iter(self._dimension_sample_space(dim_name))
+        return self._bound_dimension(dim_name).iter_sample_space()
+
     @property
     def constraint(self):
         """
         Returns:
             dict. A dictionnary of pairs *(dimension_name, constraint_value)*. Dimensions that are not constrained do not appear in this dictionnary.
         """
-        constraint_dict = {}
-        for dimension in self.dimensions.values():
-            if dimension.constraint:
-                constraint_dict[dimension.name] = dimension.constraint
-        return constraint_dict
+        return dict(self.constraint_key)
+
+    @property
+    def constraint_key(self):
+        """
+        Returns:
+            tuple. The cube's constraint, as a tuple of pairs *(dimension_name, constraint_value)* sorted by dimension name. For example :
+
+                >>> MyCube().constrain(dimB=2, dimA=1).constraint_key
+                (('dimA', 1), ('dimB', 2))
+
+            The tuple is only calculated once, and is hashable if all the constraint values are hashable.
+        """
+        if self._constraint_key is None:
+            self._constraint_key = tuple([(dim_name, value) for dim_name, value
+                in zip(self._meta.dim_names, self._constraint) if value])
+        return self._constraint_key
+
+    def _fingerprint(self):
+        """
+        Returns:
+            object. A hashable object identifying what the cube is calculated on, apart from its constraint. Subclasses that hold some data should override this method.
+        """
+        return None
+
+    def _data_models(self):
+        """
+        Returns:
+            set. The Django models whose data the measures of the cube are calculated on.
+        """
+        return set()
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return False
+        return self.constraint_key == other.constraint_key\
+            and self._fingerprint() == other._fingerprint()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self), self._fingerprint(), self.constraint_key))
 
     def _pop_first_dim(self, dim_names, free_only=False):
         """
@@ -319,16 +495,16 @@ class BaseCube(object):
             str|None. The poped dimension name, or None if there is no dimension name to pop.
         """
         for index, dim_name in enumerate(dim_names):
-            if dim_name not in self.dimensions:
+            if dim_name not in self._meta.dim_indexes:
                 raise ValueError("invalid dimension %s" % dim_name)
             #if dimension is constrained we don't need to iterate for it.
-            if free_only and dim_name in self.constraint:
+            if free_only and self._constraint[self._meta.dim_indexes[dim_name]]:
                 continue
             else:
                 return dim_names.pop(index)
         return None
 
     def __repr__(self):
-        constr_dimensions = sorted(["%s=%s" % (dim, value) for dim, value in self.constraint.iteritems()])
-        free_dimensions = sorted(list(set(self.dimensions) - set(self.constraint)))
+        constr_dimensions = ["%s=%s" % (dim, value) for dim, value in self.constraint_key]
+        free_dimensions = [dim for dim, value in zip(self._meta.dim_names, self._constraint) if not value]
         return 'Cube(%s)' % ", ".join(free_dimensions + constr_dimensions)
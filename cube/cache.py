@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#'django-cube'
+#Copyright (C) 2010 Sébastien Piquemal @ futurice
+#contact : sebastien.piquemal@futurice.com
+#futurice's website : www.futurice.com
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+A cache for the HTML of the tables rendered from cubes, with Django's cache framework.
+
+A rendered table is cached under a key built from the cube (its class, its base queryset and its constraint), the dimensions, the template, and the *data version* of all the models that the cube is calculated on. The data version of a model is bumped each time an instance of this model is saved or deleted, so a cached table is served until the data actually changes.
+
+.. note:: The data version is bumped with the signals *post_save* and *post_delete*. Changes that don't send these signals, like *QuerySet.update*, or changes made by another application, are not seen.
+
+.. note:: The signals are only connected for the models that are watched, so that the projects that don't cache tables don't pay for the data versions. A process that renders a cached or conditional table watches the models of its cube, but the signals must be connected in every process that changes the data. The cubes whose tables are cached must therefore be registered at import time with :func:`watch_cube` (or their models with :func:`watch_model`), for example in the *models.py* of the application : ::
+
+    from cube.cache import watch_cube
+    watch_cube(MusicianCube(Musician.objects.all()))
+
+.. note:: The data versions must be kept in a cache shared by all the processes (memcached, database, ...).
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import Model, signals
+from django.utils.hashcompat import md5_constructor
+
+def _version_key(model):
+    """
+    Returns:
+        str. The cache key for the data version of *model*.
+    """
+    return 'cube.version.%s.%s' % (model._meta.app_label, model._meta.object_name)
+
+#how long a data version is kept in the cache, 30 days being the longest relative timeout of memcached.
+DATA_VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+def get_data_version(model):
+    """
+    Returns:
+        int. The current data version of *model*.
+    """
+    key = _version_key(model)
+    version = cache.get(key)
+    if version is None:
+        #The version can have been evicted from the cache. The new version must then be greater than all the previous ones :
+        #it is taken in microseconds, as a bump takes longer than that. The first process to add it wins, so all the processes agree on it.
+        cache.add(key, int(time.time() * 1000000), DATA_VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+def bump_data_version(model):
+    """
+    Changes the data version of *model*, so that all the tables calculated on this model are calculated again.
+    """
+    try:
+        cache.incr(_version_key(model))
+    except ValueError:
+        get_data_version(model)
+
+def _bump_data_version_receiver(sender, **kwargs):
+    bump_data_version(sender)
+
+def watch_model(model):
+    """
+    Connects the signals that bump the data version of *model*. Calling this function several times for the same model has no effect. See the module's documentation for when it must be called.
+    """
+    dispatch_uid = _version_key(model)
+    signals.post_save.connect(_bump_data_version_receiver, sender=model, dispatch_uid=dispatch_uid)
+    signals.post_delete.connect(_bump_data_version_receiver, sender=model, dispatch_uid=dispatch_uid)
+
+def watch_cube(cube):
+    """
+    Watches all the models that *cube* is calculated on, see :func:`watch_model`.
+    """
+    for model in cube._data_models():
+        watch_model(model)
+
+def _key_repr(value):
+    """
+    Returns:
+        str. A representation of *value* that can be used in a cache key. Model instances are represented by their model and their primary key.
+    """
+    if isinstance(value, Model):
+        return '<%s.%s %r>' % (value._meta.app_label, value._meta.object_name, value.pk)
+    elif isinstance(value, (list, tuple)):
+        return '(%s)' % ', '.join([_key_repr(item) for item in value])
+    else:
+        return repr(value)
+
+def _table_digest(cube, dim_names, template_name, extra):
+    """
+    Returns:
+        tuple. *(digest, versioned)*, where *digest* is a hash of the table of *cube* by *dim_names* rendered with *template_name*, and of the data versions of the models of the cube. *versioned* is False if one of the data versions is unknown, for example with the dummy cache backend.
+    """
+    models = sorted(cube._data_models(), key=_version_key)
+    #the process that renders the table watches the models, the others must register them
+    for model in models:
+        watch_model(model)
+    versions = tuple([(_version_key(model), get_data_version(model)) for model in models])
+    cube_class = type(cube)
+    key = _key_repr((
+        '%s.%s' % (cube_class.__module__, cube_class.__name__),
+        cube._fingerprint(),
+        cube.constraint_key,
+        tuple(dim_names),
+        template_name,
+        versions,
+        extra,
+    ))
+    return md5_constructor(key).hexdigest(), None not in [version for model_key, version in versions]
+
+def fragment_key(cube, dim_names, template_name, extra=()):
+    """
+    Returns:
+        str. The cache key of the table of *cube* by *dim_names*, rendered with *template_name*. *extra* is a tuple of other values that the rendered table depends on.
+    """
+    return 'cube.table.%s' % _table_digest(cube, dim_names, template_name, extra)[0]
+
+def table_etag(cube, dim_names, template_name, extra=()):
+    """
+    Returns:
+        str|None. An ETag for the table of *cube* by *dim_names*, rendered with *template_name*, that changes with the data versions of the cube's models. None if the data versions are not available. See :func:`fragment_key` for the arguments.
+    """
+    digest, versioned = _table_digest(cube, dim_names, template_name, extra)
+    if versioned:
+        return digest
+    return None
+
+def cached_fragment(cube, dim_names, template_name, render, timeout, extra=()):
+    """
+    Returns:
+        unicode. The table returned by the callable *render*, taken from the cache if it is there (see :func:`fragment_key` for the other arguments). Otherwise, it is cached for *timeout* seconds.
+    """
+    key = fragment_key(cube, dim_names, template_name, extra)
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment = render()
+        cache.set(key, fragment, timeout)
+    return fragment
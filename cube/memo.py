@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#'django-cube'
+#Copyright (C) 2010 Sébastien Piquemal @ futurice
+#contact : sebastien.piquemal@futurice.com
+#futurice's website : www.futurice.com
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+A memo of the measures and sample spaces calculated, that lives only as long as a request. While the memo is active, a measure or a sample space that has already been calculated for an equal cube (see :class:`cube.base.BaseCube`) is not calculated again.
+
+The memo can be activated for each request with the middleware :class:`MemoMiddleware` : ::
+
+    MIDDLEWARE_CLASSES = (
+        ...
+        'cube.memo.MemoMiddleware',
+    )
+
+or for a block of code with the context manager :func:`measures_memo` : ::
+
+    with measures_memo():
+        context = cube.table_helper('dim1', 'dim2')
+
+The memo is local to the current thread.
+"""
+from contextlib import contextmanager
+import threading
+
+_local = threading.local()
+
+def activate_memo():
+    """
+    Activates the memo for the current thread, if it is not already active.
+    """
+    if getattr(_local, 'memo', None) is None:
+        _local.memo = {}
+
+def deactivate_memo():
+    """
+    Deactivates the memo for the current thread, and forgets everything it contains.
+    """
+    _local.memo = None
+
+def get_memo():
+    """
+    Returns:
+        dict|None. The memo of the current thread, or None if it is not active.
+    """
+    return getattr(_local, 'memo', None)
+
+@contextmanager
+def measures_memo():
+    """
+    A context manager that activates the memo for the block of code it wraps. If the memo is already active, the block uses it, and it is left active.
+    """
+    if get_memo() is not None:
+        yield get_memo()
+    else:
+        activate_memo()
+        try:
+            yield get_memo()
+        finally:
+            deactivate_memo()
+
+def memoized(key, function):
+    """
+    Returns:
+        object. The value of *function()*, taken from the memo at *key* if it is there. If the memo is not active, or *key* is not hashable, *function* is simply called.
+    """
+    memo = get_memo()
+    if memo is None:
+        return function()
+    try:
+        return memo[key]
+    except KeyError:
+        value = function()
+        memo[key] = value
+        return value
+    except TypeError:
+        #a constraint value is not hashable
+        return function()
+
+class MemoMiddleware(object):
+    """
+    A middleware that activates the memo for the duration of each request.
+
+    .. note:: The responses that are streamed (see :func:`cube.views.measures_export`) are calculated after the memo was deactivated.
+    """
+    def process_request(self, request):
+        #a new request never sees what was memoized for a previous one
+        deactivate_memo()
+        activate_memo()
+
+    def process_response(self, request, response):
+        deactivate_memo()
+        return response
+
+    def process_exception(self, request, exception):
+        deactivate_memo()
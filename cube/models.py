@@ -18,17 +18,96 @@
 #along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 """
-import re
 import copy
 from datetime import date, datetime
+from itertools import product
 
 from django.core.exceptions import FieldError
 from django.db.models import ForeignKey, FieldDoesNotExist, Model
+from django.db.models.query import QuerySet
 from django.db.models.sql import constants
+from django.db.models.sql.datastructures import EmptyResultSet
 
 from base import BaseDimension, BaseCube
+from memo import memoized
+from parallel import WorkerPool, parallel_map, submit
 from query import CubeQueryMixin
 
+class _CompiledLookup(object):
+    """
+    The information that :class:`Dimension` needs on its field, and that doesn't depend on a model.
+
+    Args:
+        field (str). The dimension's field.
+    """
+
+    __slots__ = ('lookup_list', 'date_part', 'filter_keys', 'groupable')
+
+    def __init__(self, field):
+        self.lookup_list = field.split('__')
+        last_lookup = self.lookup_list[-1]
+        self.groupable = last_lookup not in constants.QUERY_TERMS and last_lookup not in ['absmonth', 'absday']
+
+        #the special lookups *absmonth* and *absday* are translated to several filters
+        if last_lookup in ['absmonth', 'absday']:
+            self.date_part = last_lookup
+            base_lookup = ''.join([lookup + '__' for lookup in self.lookup_list[:-1]])
+            attrs = {'absmonth': ['month', 'year'], 'absday': ['day', 'month', 'year']}[last_lookup]
+            self.filter_keys = tuple([(base_lookup + attr, attr) for attr in attrs])
+        else:
+            self.date_part = None
+            self.filter_keys = ()
+
+class _CompiledPath(object):
+    """
+    The dimension's field, resolved on a model : the foreign keys to traverse, and how to get the values at the end.
+
+    Args:
+        field (str). The dimension's field.
+        model (Model). The model of the dimension's queryset.
+
+    Attributes:
+        hops (list). A list of tuples *(key, field)* for each foreign key to traverse.
+        kind (str). 'objects' if the path ends with a foreign key, 'values' if it ends with another field, 'dates' if it ends with a 'day', 'month' or 'year' lookup, 'absdates' if it ends with an 'absday' or 'absmonth' lookup.
+        key (str). The name of the last field, on the model reached after the foreign keys.
+        date_part (str). The date lookup, for the kinds 'dates' and 'absdates'.
+    """
+
+    __slots__ = ('hops', 'kind', 'key', 'date_part')
+
+    def __init__(self, field, model):
+        self.hops = []
+        self.kind = 'objects'
+        self.key = None
+        self.date_part = None
+        lookup_list = field.split('__')
+        key = lookup_list.pop(0)
+        next_key = lookup_list and lookup_list.pop(0) or None
+
+        #For the field lookup, we just assume that a 'month', 'day' or 'year' lookup is always terminal,
+        #same thing for a field that is not a foreign key.
+        while (key):
+            #TODO this is totally wrong ! What if there is a field called 'month', 'year', ... ? Should introspect model._meta ?
+            if next_key in ['day', 'month', 'year']:
+                self.kind, self.key, self.date_part = 'dates', key, next_key
+                break
+            elif next_key in ['absday', 'absmonth']:
+                self.kind, self.key, self.date_part = 'absdates', key, next_key
+                break
+            try:
+                model_field = model._meta.get_field_by_name(key)[0]
+            except FieldDoesNotExist:
+                raise ValueError("invalid field '%s', because '%s' is an invalid field name for %s"\
+                    % (field, key, model))
+            if type(model_field) == ForeignKey:
+                self.hops.append((key, model_field))
+                model = model_field.related.parent_model
+            else:
+                self.kind, self.key = 'values', key
+                break
+            key = next_key
+            next_key = lookup_list and lookup_list.pop(0) or None
+
 class Dimension(BaseDimension):
     """
     A dimension that is associated with a Django model's field.
@@ -37,13 +116,38 @@ class Dimension(BaseDimension):
         - sample_space (iterable|callable): The sample space of the dimension to create. If this parameter is a callable, the call will receive the dimension's base queryset as only parameter, and must return a list.
         - field (str): The name of the model's field this dimension refers to. Defaults to dimension's name.
         - queryset (Queryset): A queryset to take the default sample space from. Usefull if the parameter *sample_space* is not given. Defaults to the dimension's cube's queryset.
+        - order_by (str): How the default sample space is sorted by the database, like in *QuerySet.order_by* : a '-' prefix sorts in descending order. If the values of the dimension are objects of a foreign model, this is a field of this model, and defaults to 'pk'. Otherwise, this can only be the dimension's field, and only the direction can be changed. Defaults to the ascending order.
+        - nulls (str): 'first' or 'last', to put *None* at the beginning or at the end of the default sample space. Defaults to None, i.e. where the database puts them.
+
+    The subcubes of a cube are then taken in the order of the sample spaces of its dimensions, without sorting them again in Python (unless the cube defines :meth:`sort_key`).
     """
-    def __init__(self, field=None, queryset=None, sample_space=[]):
+
+    __slots__ = ('_field', 'queryset', 'order_by', 'nulls', '_compiled')
+
+    def __init__(self, field=None, queryset=None, sample_space=[], order_by=None, nulls=None):
         """
         """
         super(Dimension, self).__init__(sample_space=sample_space)
+        if nulls not in (None, 'first', 'last'):
+            raise ValueError("invalid value '%s' for 'nulls', must be 'first' or 'last'" % nulls)
         self._field = field
         self.queryset = queryset
+        self.order_by = order_by
+        self.nulls = nulls
+        #lookups compiled on first use, shared by all the copies of the dimension
+        self._compiled = {}
+
+    def __deepcopy__(self, memo):
+        """
+        Deep copy of the dimension. The queryset is cloned with *all()*, so neither its result cache nor the compiled lookups are copied.
+        """
+        dimension = copy.copy(self)
+        dimension.sample_space = copy.deepcopy(self.sample_space, memo)
+        if isinstance(self.queryset, QuerySet):
+            dimension.queryset = self.queryset.all()
+        else:
+            dimension.queryset = copy.deepcopy(self.queryset, memo)
+        return dimension
 
     @property
     def field(self):
@@ -71,112 +175,144 @@ class Dimension(BaseDimension):
             except TypeError:
                 #... it is callable ?
                 if hasattr(self.sample_space, '__call__'):
-                    sample_space = self.sample_space(self.queryset)
+                    sample_space = self.sample_space(self._copy_queryset())
                 else:
                     raise TypeError('\'%s\' unvalid \'sample_space\' attribute, because it is not iterable nor callable')
         else:
-            sample_space = self._default_sample_space()
+            return self._default_sample_space(sort=sort)
 
         if sort:
             return self._sort_sample_space(sample_space)
         else:
             return sample_space
 
+    def iter_sample_space(self):
+        """
+        Returns:
+            iterator. An iterator on the sample space of the dimension. The default sample space is streamed from the database with *QuerySet.iterator*, so it is never loaded in memory as a whole, and it is sorted according to :attr:`order_by`.
+        """
+        if self.constraint or self.sample_space:
+            return iter(self.get_sample_space())
+        sample_space = self._default_sample_space()
+        if isinstance(sample_space, QuerySet):
+            return sample_space.iterator()
+        return iter(sample_space)
+
     def to_queryset_filter(self):
         """
         Returns:
             dict. The django queryset filter equivalent to this dimension and its constraint. Returns *{}* if the dimension is not constrained. 
         """
-        filter_dict = {}
-        lookup_list = re.split('__', self.field)
-
         if not self.constraint:
-            pass
-        elif (isinstance(self.constraint, date) or isinstance(self.constraint, datetime)) and lookup_list[-1] in ['absmonth', 'absday']:
-            base_lookup = ''
-            for lookup_value in lookup_list[:-1]:
-                base_lookup += lookup_value + '__'
-
-            if lookup_list[-1] == 'absmonth':
-                filter_dict[base_lookup + 'month'] = self.constraint.month
-                filter_dict[base_lookup + 'year'] = self.constraint.year
-            elif lookup_list[-1] == 'absday':
-                filter_dict[base_lookup + 'day'] = self.constraint.day
-                filter_dict[base_lookup + 'month'] = self.constraint.month
-                filter_dict[base_lookup + 'year'] = self.constraint.year
+            return {}
+        lookup = self._compiled_lookup()
+        if lookup.date_part and isinstance(self.constraint, date):
+            return dict([(filter_key, getattr(self.constraint, attr)) for filter_key, attr in lookup.filter_keys])
         else:
-            filter_dict.update({self.field: self.constraint})
-        return filter_dict
+            return {self.field: self.constraint}
 
-    def _default_sample_space(self):
+    @property
+    def groupable(self):
         """
-        .. todo:: rewrite prettier
+        Returns:
+            bool. True if the measures can be grouped by the values of this dimension in one query, i.e. if the dimension's field is a plain field name, and not a field-lookup.
         """
-        sample_space = []
-        if not self.queryset: return []
-        lookup_list = re.split('__', self.field)
-
-        if len(lookup_list) == 1:
-            key = lookup_list[0]
-            try:
-                field = self.queryset.model._meta.get_field_by_name(key)[0]
-            except FieldDoesNotExist:
-                raise ValueError("invalid field '%s', because '%s' is an invalid field name for %s"\
-                    % (self.field, key, self.queryset.model))
-            #if ForeignKey, we get all distinct objects of foreign model
-            if type(field) == ForeignKey:
-                sample_space = self.queryset.values_list(key, flat=True).distinct()
-                filter_dict = {'%s__in' % field.rel.field_name: sample_space}
-                sample_space = field.related.parent_model.objects.filter(**filter_dict)
-            else:
-                sample_space = self.queryset.values_list(key, flat=True).distinct()
+        return self._compiled_lookup().groupable
 
+    def _group_value(self, value):
+        """
+        Returns:
+            object. The value that a grouped query returns for the dimension's field, when the dimension is constrained to *value*.
+        """
+        if isinstance(value, Model):
+            return value.pk
         else:
-            queryset = self.queryset
+            return value
 
-            #we assume first item is always a field_name
-            key = lookup_list.pop(0)
-            
-            #we loop over the rest
-            next_key = lookup_list.pop(0)
-    
-            #For the field lookup, we just assume that a 'month', 'day' or 'year' lookup is always terminal,
-            #same thing for a field that is not a foreign key.
-            while (key):
-
-                #TODO this is totally wrong ! What if there is a field called 'month', 'year', ... ? Should introspect model._meta ?
-                if next_key in ['day', 'month', 'year']:
-                    for date in queryset.dates(key, next_key):
-                        sample_space.append(getattr(date, next_key))
-                    break
-                elif next_key in ['absday', 'absmonth']:
-                    query_key = {'absday': 'day', 'absmonth': 'month'}[next_key]
-                    for date in queryset.dates(key, query_key):
-                        sample_space.append(date)
-                    break 
-                else:
-                    try:
-                        field = queryset.model._meta.get_field_by_name(key)[0]
-                    except FieldDoesNotExist:
-                        raise ValueError("invalid field %s, because %s is an invalid field name for %s"\
-                            % (self.field, key, queryset.model))
-                    #if ForeignKey, we get all distinct objects of foreign model
-                    if type(field) == ForeignKey:
-                        sample_space = queryset.values_list(key, flat=True).distinct()
-                        filter_dict = {'%s__in' % field.rel.field_name: sample_space}
-                        queryset = sample_space = field.related.parent_model.objects.filter(**filter_dict)
-                    #else, we just return values
-                    else:
-                        sample_space = queryset.values_list(key, flat=True).distinct()
-                        break
-
-                key = next_key
-                try:
-                    next_key = lookup_list.pop(0)
-                except IndexError:
-                    next_key = None
-
-        return sample_space
+    def _compiled_lookup(self):
+        """
+        Returns:
+            _CompiledLookup. The dimension's field, parsed once for all.
+        """
+        try:
+            return self._compiled[self.field]
+        except KeyError:
+            lookup = _CompiledLookup(self.field)
+            self._compiled[self.field] = lookup
+            return lookup
+
+    def _compiled_path(self, model):
+        """
+        Returns:
+            _CompiledPath. The dimension's field, resolved once for all on *model*.
+        """
+        try:
+            return self._compiled[(self.field, model)]
+        except KeyError:
+            path = _CompiledPath(self.field, model)
+            self._compiled[(self.field, model)] = path
+            return path
+
+    def _copy_queryset(self):
+        """
+        Returns:
+            Queryset. A copy of the dimension's queryset, or None. The dimension's queryset can be shared by several cubes and threads, so it is never evaluated itself.
+        """
+        if self.queryset is None:
+            return None
+        return self.queryset.all()
+
+    def _default_sample_space(self, sort=False):
+        """
+        Kwargs:
+            sort (bool): whether to sort or not the sample space returned. It is always sorted by the database according to :attr:`order_by`, except for the 'day', 'month' and 'year' lookups that are sorted in Python, when *sort* is True or :attr:`order_by` is given.
+
+        Returns:
+            iterable. The sample space taken from the dimension's queryset.
+        """
+        queryset = self._copy_queryset()
+        #the queryset is not evaluated just to know if there is one
+        if queryset is None: return []
+        path = self._compiled_path(queryset.model)
+
+        #the distinct objects of the last foreign model are selected with one subquery, that joins all the foreign keys
+        if path.hops:
+            keys = '__'.join([key for key, field in path.hops])
+            last_field = path.hops[-1][1]
+            filter_dict = {'%s__in' % last_field.rel.field_name: queryset.values(keys)}
+            queryset = last_field.related.parent_model._default_manager.filter(**filter_dict)
+
+        order_by = self.order_by or ''
+        descending = order_by.startswith('-')
+        if path.kind != 'objects' and order_by.lstrip('-') not in ('', self.field):
+            raise ValueError("invalid order_by '%s', the values of '%s' can only be sorted by themselves" % (order_by, self.field))
+
+        if path.kind == 'objects':
+            sample_space = queryset.order_by(order_by or 'pk')
+        elif path.kind == 'values':
+            sample_space = queryset.values_list(path.key, flat=True).distinct().order_by((descending and '-' or '') + path.key)
+        elif path.kind == 'dates':
+            sample_space = [getattr(date, path.date_part) for date in queryset.dates(path.key, path.date_part)]
+            #a declared ordering is applied even when the sample space is not asked to be sorted
+            if sort or self.order_by:
+                sample_space.sort(reverse=descending)
+        elif path.kind == 'absdates':
+            query_kind = {'absday': 'day', 'absmonth': 'month'}[path.date_part]
+            sample_space = list(queryset.dates(path.key, query_kind, order=descending and 'DESC' or 'ASC'))
+
+        if self.nulls:
+            #the values are already sorted, *None* is only moved
+            sample_space = list(sample_space)
+            values = [value for value in sample_space if value is not None]
+            nulls = [None] * (len(sample_space) - len(values))
+            if self.nulls == 'first':
+                sample_space = nulls + values
+            else:
+                sample_space = values + nulls
+        if sort:
+            return list(sample_space)
+        else:
+            return sample_space
     
     def _sort_sample_space(self, sample_space):
         """
@@ -187,6 +323,9 @@ class Dimension(BaseDimension):
         else:
             return super(Dimension, self)._sort_sample_space(sample_space)
 
+#the maximum number of values in the *__in* filters of a grouped query, SQLite accepting at most 999 parameters
+GROUPED_FILTER_MAX_PARAMS = 500
+
 class Cube(BaseCube, CubeQueryMixin):
     """
     A cube that can calculates measures on Django querysets.
@@ -196,16 +335,97 @@ class Cube(BaseCube, CubeQueryMixin):
 
     Kwargs:
         measure_none (object): the value that the measure should actually return if the calculation returned *None*.
+        workers (int): if given, the measures that cannot be calculated with a grouped query are calculated concurrently by this number of threads, each with its own database connection. Defaults to None, i.e. the measures are calculated one by one.
+
+    Cubes are immutable : the base queryset is read-only, and :meth:`constrain` returns a new cube. A cube can therefore be created once, for example at import time, and shared by all the requests and threads.
+
+    The methods :meth:`ameasure`, :meth:`ameasures` and :meth:`atable_helper` start a calculation in the background, and return a :class:`cube.parallel.Future`, so that the measures of several cubes can be calculated concurrently.
+
+    A cube can declare an attribute *aggregate*, which is a Django aggregate that calculates the same measure as :meth:`aggregation`. For example : ::
+
+        class MyCube(Cube):
+            aggregate = Count('pk')
+
+            @staticmethod
+            def aggregation(queryset):
+                return queryset.count()
+
+    When iterating over measures, all the measures of a batch of subcubes are then calculated with only one grouped query, for the dimensions that are :meth:`Dimension.groupable`.
     """
 
-    def __init__(self, queryset, measure_none=0):
+    aggregate = None
+
+    __slots__ = ('_queryset', 'measure_none', 'workers', '_fingerprint_cache')
+
+    def __init__(self, queryset, measure_none=0, workers=None):
         super(Cube, self).__init__()
-        self.queryset = queryset
+        self._queryset = queryset
         self.measure_none = measure_none
+        self.workers = workers
+        #*[fingerprint]*, shared by the cube and all its subcubes
+        self._fingerprint_cache = [None]
+
+    @property
+    def queryset(self):
+        """
+        Returns:
+            Queryset. A new copy of the cube's base queryset, so that evaluating it never fills the result cache of a queryset shared by several threads.
+        """
+        return self._queryset.all()
+
+    def __reduce__(self):
+        """
+        Pickling support. A cube is pickled as its class, the class, database, model and SQL query of its base queryset, and its constraint, so the base queryset is never evaluated. The attributes of a subclass, in its *__dict__* or declared in its *__slots__*, are pickled as well.
+        """
+        queryset = self._queryset
+        extra_state = {}
+        for cube_class in type(self).__mro__:
+            if cube_class in (Cube, BaseCube):
+                break
+            slots = cube_class.__dict__.get('__slots__', ())
+            if isinstance(slots, basestring):
+                slots = (slots,)
+            for slot in slots:
+                if slot not in ('__dict__', '__weakref__') and hasattr(self, slot):
+                    extra_state[slot] = getattr(self, slot)
+        state = getattr(self, '__dict__', None) or None
+        return (
+            _unpickle_cube,
+            (type(self), type(queryset), queryset.db, queryset.model, queryset.query, self.measure_none, self.workers, self._constraint),
+            (state, extra_state) if state or extra_state else None,
+        )
+
+    def _fingerprint(self):
+        """
+        Returns:
+            tuple. A fingerprint of the cube's base queryset (class, database, model and SQL query), and of *measure_none*. It is only calculated once for a cube and all its subcubes.
+        """
+        if self._fingerprint_cache[0] is None:
+            queryset = self._queryset
+            try:
+                sql = queryset.query.get_compiler(queryset.db).as_sql()
+            except EmptyResultSet:
+                sql = None
+            self._fingerprint_cache[0] = (type(queryset), queryset.db, queryset.model, sql)
+        return self._fingerprint_cache[0] + (self.measure_none,)
 
-        #give all the dimensions a default queryset if they don't already have one.
-        for dim_name, dimension in self.dimensions.iteritems():
-            dimension.queryset = dimension.queryset or queryset
+    def _data_models(self):
+        models = set([self._queryset.model])
+        for dim_name in self._meta.dim_names:
+            dimension = self._bound_dimension(dim_name)
+            #the models of the foreign keys followed by the dimension's field
+            if isinstance(dimension, Dimension) and dimension.queryset is not None:
+                models.add(dimension.queryset.model)
+                for key, field in dimension._compiled_path(dimension.queryset.model).hops:
+                    models.add(field.related.parent_model)
+        return models
+
+    def _bind_dimension(self, dim_name):
+        dimension = super(Cube, self)._bind_dimension(dim_name)
+        #gives the dimension a default queryset if it doesn't already have one.
+        if dimension.queryset is None:
+            dimension.queryset = self.queryset
+        return dimension
 
     def measure(self, **coordinates):
         if coordinates:
@@ -215,20 +435,174 @@ class Cube(BaseCube, CubeQueryMixin):
 
             #we check the coordinates passed
             for dim_name, value in coordinates.iteritems():
-                if not dim_name in self.dimensions:
+                if not dim_name in self._meta.dimensions:
                     raise ValueError("invalid dimension '%s'" % dim_name)
                 #If dimension is already constrained, we only accept the same value in *coordinates*
-                if dim_name in self.constraint and constraint[dim_name] != value:
+                if dim_name in constraint and constraint[dim_name] != value:
                     raise ValueError("dimension '%s' is already constrained to a different value" % dim_name)
 
             #we get a subcube constrained with *coordinates*, and calculate the measure on this whole subcube. 
             return self.constrain(**coordinates).measure()
         else:
-            #we build the filters for the queryset
-            filters_dict = {}
-            for dim_name, dimension in self.dimensions.iteritems():
-                filters_dict.update(dimension.to_queryset_filter())
-            return self.aggregation(self.queryset.filter(**filters_dict)) or self.measure_none
+            return memoized(('measure', self), self._calculate_measure)
+
+    def ameasure(self, **coordinates):
+        """
+        Returns:
+            Future. The future result of :meth:`measure`, calculated in another thread (see :func:`cube.parallel.submit`).
+        """
+        return submit(self.measure, **coordinates)
+
+    def ameasures(self, *dim_names):
+        """
+        Returns:
+            Future. The future result of :meth:`measures`, calculated in another thread.
+        """
+        return submit(self.measures, *dim_names)
+
+    def atable_helper(self, *dim_names, **kwargs):
+        """
+        Returns:
+            Future. The future result of :meth:`table_helper`, calculated in another thread.
+        """
+        return submit(self.table_helper, *dim_names, **kwargs)
+
+    def _calculate_measure(self):
+        """
+        Returns:
+            object. The measure on the whole cube, calculated with :meth:`aggregation`.
+        """
+        return self.aggregation(self.queryset.filter(**self._queryset_filter())) or self.measure_none
+
+    def _queryset_filter(self):
+        """
+        Returns:
+            dict. The django queryset filter equivalent to the cube's constraint.
+        """
+        filters_dict = {}
+        for dim_name, value in self.constraint_key:
+            filters_dict.update(self._meta.dimensions[dim_name]._bind(value).to_queryset_filter())
+        return filters_dict
+
+    def _is_groupable(self, dim_names):
+        """
+        Returns:
+            bool. True if the measures for the dimensions *dim_names* can be calculated with a grouped query.
+        """
+        if self.aggregate is None:
+            return False
+        for dim_name in dim_names:
+            if not self._meta.dimensions[dim_name].groupable:
+                return False
+        return True
+
+    def _grouped_measures(self, dim_names, filters_dict={}):
+        """
+        Calculates the measures of the cube grouped by the dimensions *dim_names*, with one query. Only the non-empty groups are returned.
+
+        Kwargs:
+            filters_dict (dict): extra filters for the queryset.
+
+        Returns:
+            iterator. An iterator on tuples *(group, measure)*, where *group* is the tuple of the grouped values of the dimensions *dim_names* (see :meth:`Dimension._group_value`).
+        """
+        fields = [self._meta.dimensions[dim_name].field for dim_name in dim_names]
+        queryset = self.queryset.filter(**self._queryset_filter()).filter(**filters_dict)
+        #we clear the ordering, otherwise the ordering fields would be added to the GROUP BY
+        queryset = queryset.values(*fields).annotate(cube_measure=self.aggregate).order_by()
+        for row in queryset.iterator():
+            yield tuple([row[field] for field in fields]), row['cube_measure']
+
+    def _measures_cells(self, dim_names, axes, **kwargs):
+        if not self._is_groupable(dim_names):
+            return super(Cube, self)._measures_cells(dim_names, axes, **kwargs)
+        return self._grouped_cells(dim_names, axes)
+
+    def _grouped_filters(self, dim_names, values_list):
+        """
+        Returns:
+            dict. The filters *{'field__in': values}* that restrict a grouped query to the grouped values *values_list* of the dimensions *dim_names*. The shortest lists are used first, within :data:`GROUPED_FILTER_MAX_PARAMS` parameters : the other dimensions are not restricted, and their extra groups are just ignored.
+        """
+        filters_dict = {}
+        params_left = GROUPED_FILTER_MAX_PARAMS
+        for dim_name, values in sorted(zip(dim_names, values_list), key=lambda item: len(item[1])):
+            if len(values) > params_left:
+                break
+            filters_dict['%s__in' % self._meta.dimensions[dim_name].field] = values
+            params_left -= len(values)
+        return filters_dict
+
+    def _grouped_cells(self, dim_names, axes):
+        """
+        Returns:
+            iterator. Same as :meth:`_measures_cells`, but calculated with only one grouped query. The groups whose values are not in *axes* are ignored. The cells with a false value (None, 0, '', ...), for which the dimension is not constrained (see :meth:`constrain`), are calculated one by one.
+        """
+        #for each axis, maps a grouped value to its index in the axis
+        index_maps = []
+        for dim_name, axis in zip(dim_names, axes):
+            dimension = self._meta.dimensions[dim_name]
+            index_maps.append(dict([(dimension._group_value(value), index) for index, value in enumerate(axis) if value]))
+
+        #we restrict the grouped query to the values of the axes
+        filters_dict = self._grouped_filters(dim_names, [index_map.keys() for index_map in index_maps])
+        for group, measure in self._grouped_measures(dim_names, filters_dict):
+            try:
+                indexes = tuple([index_map[value] for index_map, value in zip(index_maps, group)])
+            except KeyError:
+                continue
+            yield indexes, measure or self.measure_none
+
+        if [axis for axis, index_map in zip(axes, index_maps) if len(axis) != len(index_map)]:
+            indexes_list = [indexes for indexes in product(*[range(len(axis)) for axis in axes])
+                if not all([axis[index] for axis, index in zip(axes, indexes)])]
+            for cell in self._measures_cells_batch(dim_names, axes, indexes_list):
+                yield cell
+
+    def _worker_pool(self):
+        if self.workers:
+            return WorkerPool(self.workers)
+        return None
+
+    def _measures_batch(self, dim_names, coordinates_list, pool=None):
+        if not coordinates_list:
+            return []
+        if not self._is_groupable(dim_names):
+            return self._single_measures(dim_names, coordinates_list, pool)
+
+        #a false value doesn't constrain its dimension (see :meth:`constrain`), so these subcubes are not a group of the grouped query
+        grouped_flags = [all([coordinates[dim_name] for dim_name in dim_names]) for coordinates in coordinates_list]
+        grouped_list = [coordinates for coordinates, grouped in zip(coordinates_list, grouped_flags) if grouped]
+        single_list = [coordinates for coordinates, grouped in zip(coordinates_list, grouped_flags) if not grouped]
+        single_measures = iter(self._single_measures(dim_names, single_list, pool))
+
+        #we restrict the grouped query to the values in *grouped_list*
+        filters_dict = self._grouped_filters(dim_names, [
+            list(set([self._meta.dimensions[dim_name]._group_value(coordinates[dim_name]) for coordinates in grouped_list]))
+            for dim_name in dim_names
+        ])
+        grouped_measures = grouped_list and dict(self._grouped_measures(dim_names, filters_dict)) or {}
+
+        measures = []
+        for coordinates, grouped in zip(coordinates_list, grouped_flags):
+            if not grouped:
+                measures.append(single_measures.next())
+                continue
+            group = tuple([self._meta.dimensions[dim_name]._group_value(coordinates[dim_name]) for dim_name in dim_names])
+            measures.append(grouped_measures.get(group) or self.measure_none)
+        return measures
+
+    def _single_measures(self, dim_names, coordinates_list, pool=None):
+        """
+        Returns:
+            list. The measures of the subcubes at *coordinates_list*, calculated one by one, concurrently if the cube has *workers*.
+        """
+        if self.workers and len(coordinates_list) > 1:
+            #the subcubes are independent, so their measures can be calculated concurrently
+            subcubes = [self.constrain(**coordinates) for coordinates in coordinates_list]
+            if pool is not None:
+                return pool.map(lambda subcube: subcube.measure(), subcubes)
+            return parallel_map(lambda subcube: subcube.measure(), subcubes, self.workers)
+        return super(Cube, self)._measures_batch(dim_names, coordinates_list)
 
     @staticmethod
     def aggregation(queryset):
@@ -241,3 +615,13 @@ class Cube(BaseCube, CubeQueryMixin):
         **In practice**, the *queryset* received as a parameter will **always** be : the cube's base queryset, filtered according to the cube's constraint.
         """
         raise NotImplementedError
+
+def _unpickle_cube(cube_class, queryset_class, db, model, query, measure_none, workers, constraint):
+    """
+    Returns:
+        Cube. The cube pickled by :meth:`Cube.__reduce__`.
+    """
+    cube = cube_class.__new__(cube_class)
+    Cube.__init__(cube, queryset_class(model=model, query=query, using=db), measure_none=measure_none, workers=workers)
+    cube._constraint = constraint
+    return cube
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+#'django-cube'
+#Copyright (C) 2010 Sébastien Piquemal @ futurice
+#contact : sebastien.piquemal@futurice.com
+#futurice's website : www.futurice.com
+
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Calculation of measures in several threads or processes.
+
+Django opens one database connection per thread, so each worker thread has its own connection, that it closes when it has finished. Each worker process opens its own connections as well.
+
+Several calculations can also be started at once in the background, with :func:`submit` or the methods :meth:`cube.models.Cube.ameasure`, :meth:`cube.models.Cube.ameasures` and :meth:`cube.models.Cube.atable_helper`, and their results collected later : ::
+
+    futures = [cube.atable_helper('dim1', 'dim2') for cube in cubes]
+    contexts = gather(futures)
+
+.. note:: The memo of :mod:`cube.memo` is local to a thread, so it is not used by the workers.
+"""
+import os
+import sys
+import threading
+import Queue
+import cPickle as pickle
+import multiprocessing
+
+from django.db import connections
+from django.utils.hashcompat import md5_constructor
+
+from cache import _key_repr
+from query import SparseMeasures
+
+def close_connections():
+    """
+    Closes all the database connections of the current thread.
+    """
+    for connection in connections.all():
+        connection.close()
+
+def parallel_map(function, items, workers):
+    """
+    Returns:
+        list. The list *[function(item1), ..., function(itemN)]*, calculated by *workers* threads. The results are in the same order as *items*.
+
+    If *function* raises an exception, the remaining items are not calculated, and the exception is raised again in the calling thread.
+
+    The threads are only used for this call. To calculate several lists with the same threads and connections, use a :class:`WorkerPool`.
+    """
+    pool = WorkerPool(workers)
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+
+class WorkerPool(object):
+    """
+    A pool of worker threads, that can be reused for several :meth:`map`, so that the threads and their database connections are only opened once. The threads are started on the first :meth:`map`, and stopped by :meth:`close`, that also closes their database connections.
+
+    Args:
+        workers (int): the number of threads.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self._tasks = Queue.Queue()
+        self._threads = []
+
+    def _work(self):
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    return
+                function, index, item, results, errors, finished = task
+                try:
+                    #after an error, the remaining items are not calculated
+                    if not errors:
+                        results[index] = function(item)
+                except:
+                    errors.append(sys.exc_info())
+                finished.put(index)
+        finally:
+            close_connections()
+
+    def map(self, function, items):
+        """
+        Returns:
+            list. Same as :func:`parallel_map`, calculated by the threads of the pool.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        errors = []
+        finished = Queue.Queue()
+        while len(self._threads) < min(self.workers, len(items)):
+            thread = threading.Thread(target=self._work)
+            #a pool that is never closed doesn't prevent the process from exiting
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+        for index, item in enumerate(items):
+            self._tasks.put((function, index, item, results, errors, finished))
+        for item in items:
+            finished.get()
+
+        if errors:
+            exc_type, exc_value, traceback = errors[0]
+            raise exc_type, exc_value, traceback
+        return results
+
+    def close(self):
+        """
+        Stops the threads of the pool, which close their database connections.
+        """
+        for thread in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+class FutureTimeout(Exception):
+    """
+    Raised by :meth:`Future.result` when the calculation is not finished in time.
+    """
+
+class Future(object):
+    """
+    The result of a function that is calculated in another thread, see :func:`submit`.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        """
+        Returns:
+            bool. True if the calculation is finished.
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the calculation to finish, at most *timeout* seconds if it is given.
+
+        Returns:
+            object. The result of the calculation. If the calculation raised an exception, the exception is raised again.
+
+        Raises:
+            FutureTimeout. If the calculation is not finished after *timeout* seconds.
+        """
+        if not self._done.wait(timeout):
+            raise FutureTimeout("the calculation is not finished after %s seconds" % timeout)
+        if self._exc_info is not None:
+            exc_type, exc_value, traceback = self._exc_info
+            raise exc_type, exc_value, traceback
+        return self._result
+
+def submit(function, *args, **kwargs):
+    """
+    Starts calculating *function(\*args, \*\*kwargs)* in a new thread, with its own database connection, that is closed when the calculation is finished.
+
+    Returns:
+        Future. The future result of the calculation.
+    """
+    future = Future()
+
+    def work():
+        try:
+            future._result = function(*args, **kwargs)
+        except:
+            future._exc_info = sys.exc_info()
+        close_connections()
+        future._done.set()
+
+    thread = threading.Thread(target=work)
+    thread.daemon = True
+    thread.start()
+    return future
+
+def gather(futures, timeout=None):
+    """
+    Returns:
+        list. The results of *futures*, in the same order. *timeout* is the maximum time to wait for each future.
+    """
+    return [future.result(timeout) for future in futures]
+
+def _forget_connections():
+    """
+    Makes the current process open its own database connections. The connections inherited from the parent process are not closed, because that would close them for the parent as well.
+    """
+    for connection in connections.all():
+        connection.connection = None
+
+def _partition_cells(args):
+    """
+    Returns:
+        tuple. *(partition_index, cells)*, where *cells* are the non-empty cells of the partition *partition_index* of the first axis, as tuples *(indexes, measure)*. *indexes* are the indexes of the cell in the other axes. See :func:`precompute`.
+    """
+    cube, dim_names, partition_axes, partition_index = args
+    cells = []
+    for indexes, measure in cube._measures_cells(dim_names, partition_axes):
+        if measure != cube.measure_none:
+            cells.append((tuple(indexes[1:]), measure))
+    return partition_index, cells
+
+def _checkpoint_path(checkpoint_dir, cube, dim_names, other_axes_digest, value):
+    """
+    Returns:
+        str. The path of the checkpoint file for the partition of *cube* by *dim_names* where the first dimension is *value*. The path changes with *other_axes_digest*, a digest of the axes of the other dimensions, so that a checkpoint is not used anymore if the sample spaces have changed.
+    """
+    cube_class = type(cube)
+    digest = md5_constructor(_key_repr((
+        '%s.%s' % (cube_class.__module__, cube_class.__name__),
+        cube._fingerprint(),
+        cube.constraint_key,
+        tuple(dim_names),
+        other_axes_digest,
+        value,
+    ))).hexdigest()
+    return os.path.join(checkpoint_dir, 'cube-partition-%s.pickle' % digest)
+
+def precompute(cube, partition_dim_name, *dim_names, **kwargs):
+    """
+    Calculates all the measures of *cube* for the dimensions *partition_dim_name* and *dim_names*, by partitions : one partition for each value of *partition_dim_name*.
+
+    Kwargs:
+        processes (int): if given, the partitions are calculated by this number of worker processes. The cube is then pickled to be sent to the workers (see :meth:`cube.models.Cube.__reduce__`), so its class must be importable. Defaults to None, i.e. all the partitions are calculated in the current process.
+        checkpoint_dir (str): if given, each partition calculated is saved in this directory, and the partitions already saved are not calculated again. A job that was interrupted can therefore be resumed by running it again. A saved partition is only used if the sample spaces of the other dimensions have not changed.
+
+    Returns:
+        SparseMeasures. All the measures, with *partition_dim_name* as first dimension. Use :meth:`SparseMeasures.to_measures_list` or :meth:`SparseMeasures.to_measures_dict` to get the same structures as :meth:`cube.query.CubeQueryMixin.measures_list` or :meth:`cube.query.CubeQueryMixin.measures_dict`.
+    """
+    processes = kwargs.get('processes')
+    checkpoint_dir = kwargs.get('checkpoint_dir')
+    dim_names = [partition_dim_name] + list(dim_names)
+    axes = cube._measures_axes(dim_names)
+    other_axes = list(axes[1:])
+    other_axes_digest = checkpoint_dir and md5_constructor(_key_repr(other_axes)).hexdigest()
+
+    def checkpoint_path(partition_index):
+        return _checkpoint_path(checkpoint_dir, cube, dim_names, other_axes_digest, axes[0][partition_index])
+
+    def add_cells(partition_index, partition_cells):
+        for indexes, measure in partition_cells:
+            cells.append(((partition_index,) + indexes, measure))
+
+    #the partitions already calculated are loaded from their checkpoint
+    cells = []
+    todo = []
+    for partition_index in range(len(axes[0])):
+        path = checkpoint_dir and checkpoint_path(partition_index)
+        if path and os.path.exists(path):
+            with open(path, 'rb') as checkpoint_file:
+                add_cells(partition_index, pickle.load(checkpoint_file))
+        else:
+            todo.append(partition_index)
+
+    #each partition only receives its value of the first axis
+    tasks = [(cube, dim_names, [[axes[0][index]]] + other_axes, index) for index in todo]
+    if processes and tasks:
+        pool = multiprocessing.Pool(processes, initializer=_forget_connections)
+        try:
+            for partition_index, partition_cells in pool.imap_unordered(_partition_cells, tasks):
+                if checkpoint_dir:
+                    _save_partition(checkpoint_path(partition_index), partition_cells)
+                add_cells(partition_index, partition_cells)
+        finally:
+            pool.terminate()
+    else:
+        for task in tasks:
+            partition_index, partition_cells = _partition_cells(task)
+            if checkpoint_dir:
+                _save_partition(checkpoint_path(partition_index), partition_cells)
+            add_cells(partition_index, partition_cells)
+
+    cells.sort()
+    return SparseMeasures(dim_names, axes, cells, measure_none=cube.measure_none)
+
+def _save_partition(path, cells):
+    """
+    Saves the *cells* of a partition in the checkpoint file *path*. The file is written under a temporary name first, so that a crash never leaves a partial checkpoint.
+    """
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as tmp_file:
+        pickle.dump(cells, tmp_file, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path)
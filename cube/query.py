@@ -17,17 +17,151 @@
 #You should have received a copy of the GNU General Public License
 #along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+from itertools import product
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from .utils import odict
 
+class _Rollup(object):
+    """
+    Class of the constant :data:`ROLLUP`.
+    """
+    def __repr__(self):
+        return 'ROLLUP'
+
+    def __reduce__(self):
+        return 'ROLLUP'
+
+#: In the keys of a flat *measures_dict*, stands for a dimension that is not fixed.
+ROLLUP = _Rollup()
+
+class SparseMeasures(object):
+    """
+    Measures from a cube in coordinate format : only the cells whose measure is not *measure_none* are stored, sorted in the order of the axes.
+
+    Args:
+        dim_names (list). The names of the dimensions.
+        axes (list). For each dimension, the list of its values.
+        cells (list). A sorted list of tuples *(indexes, measure)*, where *indexes* are the indexes of the cell's coordinates in *axes*.
+
+    Kwargs:
+        measure_none (object): the measure of the cells that are not stored.
+
+    The cells are stored in parallel arrays : *coords* contains for each dimension an array of indexes in the dimension's axis, and *values* contains the measures. When pickled, the arrays are stored as raw bytes.
+    """
+
+    def __init__(self, dim_names, axes, cells, measure_none=0):
+        self.dim_names = list(dim_names)
+        self.axes = axes
+        self.measure_none = measure_none
+        self.coords = [array('l') for dim_name in self.dim_names]
+        self.values = []
+        for indexes, measure in cells:
+            for coord, index in zip(self.coords, indexes):
+                coord.append(index)
+            self.values.append(measure)
+        self._positions = None
+        self._axes_indexes = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getstate__(self):
+        #the coordinates are pickled as raw bytes, and the lookup tables are not pickled
+        state = self.__dict__.copy()
+        state['coords'] = [(coord.typecode, coord.tostring()) for coord in self.coords]
+        state['_positions'] = state['_axes_indexes'] = None
+        return state
+
+    def __setstate__(self, state):
+        state['coords'] = [array(typecode, data) for typecode, data in state['coords']]
+        self.__dict__.update(state)
+
+    def __iter__(self):
+        """
+        Returns:
+            iterator. An iterator on tuples *(coordinates, measure)* for all the stored cells, in the order of the axes. *coordinates* is the tuple of the cell's values for each dimension.
+        """
+        for position, measure in enumerate(self.values):
+            yield tuple([axis[coord[position]] for axis, coord in zip(self.axes, self.coords)]), measure
+
+    def measure(self, **coordinates):
+        """
+        Returns:
+            object. The measure at *coordinates*, which must give a value for each dimension.
+        """
+        if self._positions is None:
+            self._axes_indexes = [dict([(value, index) for index, value in enumerate(axis)]) for axis in self.axes]
+            self._positions = dict([(indexes, position) for position, indexes in enumerate(zip(*self.coords))])
+        try:
+            indexes = tuple([axis_indexes[coordinates[dim_name]] for dim_name, axis_indexes in zip(self.dim_names, self._axes_indexes)])
+        except KeyError:
+            raise ValueError("invalid coordinates %s" % coordinates)
+        position = self._positions.get(indexes)
+        if position is None:
+            return self.measure_none
+        return self.values[position]
+
+    def to_measures_list(self):
+        """
+        Returns:
+            list. The measures, with the same structure as :meth:`CubeQueryMixin.measures_list`.
+        """
+        if not self.dim_names:
+            return []
+        returned_list = self._empty_list(0)
+        for position, measure in enumerate(self.values):
+            sub_list = returned_list
+            for coord in self.coords[:-1]:
+                sub_list = sub_list[coord[position]]
+            sub_list[self.coords[-1][position]] = measure
+        return returned_list
+
+    def to_measures_dict(self):
+        """
+        Returns:
+            dict. The measures, with the same structure as :meth:`CubeQueryMixin.measures_dict` with *full=False*.
+        """
+        if not self.dim_names:
+            return odict()
+        returned_dict = self._empty_dict(0)
+        for coordinates, measure in self:
+            sub_dict = returned_dict
+            for value in coordinates:
+                sub_dict = sub_dict[value]
+            sub_dict['measure'] = measure
+        return returned_dict
+
+    def _empty_list(self, depth):
+        if depth == len(self.axes) - 1:
+            return [self.measure_none] * len(self.axes[depth])
+        return [self._empty_list(depth + 1) for value in self.axes[depth]]
+
+    def _empty_dict(self, depth):
+        returned_dict = odict()
+        for value in self.axes[depth]:
+            if depth == len(self.axes) - 1:
+                returned_dict[value] = {'measure': self.measure_none}
+            else:
+                returned_dict[value] = self._empty_dict(depth + 1)
+        return returned_dict
+
 class CubeQueryMixin(object):
     """
     Mixin class whose purpose is to separate querying of measures, from the cube logic itself. 
     """
 
+    __slots__ = ()
+
     def measures_dict(self, *dim_names, **kwargs):
         """
         Returns: 
-            dict. An ordered dictionnary of measures from the cube, structured following *dim_names*. For example :
+            dict. A dictionnary of measures from the cube, structured following *dim_names*. The dictionnaries whose keys are dimensions' values are ordered dictionnaries, sorted like the subcubes. For example :
 
                 >>> cube.measures_dict('dim2', 'dim1') == {
                 ...     'subcubes': {
@@ -60,9 +194,28 @@ class CubeQueryMixin(object):
                 ...
                 ...     },
                 ... }
+
+            If *format='flat'*, the measures are returned in one ordered dictionnary, whose keys are tuples of values of the dimensions in *dim_names*. In the keys, :data:`ROLLUP` stands for a dimension that is not fixed. For example : ::
+
+                >>> cube.measures_dict('dim2', 'dim1', format='flat') == {
+                ...     (ROLLUP, ROLLUP): measure,
+                ...     (dim2_val1, ROLLUP): measure1,
+                ...     (dim2_val1, dim1_val1): measure1_1,
+                ...
+                ...     (dim2_valN, dim1_valN): measureN_N,
+                ... }
+
+            With *full=False*, only the keys without :data:`ROLLUP` are returned. This format is built without calculating the subcubes' *measures_dict*, and with one grouped query per level if the cube has an *aggregate*.
         """
+        format = kwargs.pop('format', 'nested')
         full = kwargs.setdefault('full', True)
-        returned_dict = odict()
+        if format == 'flat':
+            return self._flat_measures_dict(list(dim_names), full)
+        elif format != 'nested':
+            raise ValueError("invalid format '%s'" % format)
+
+        #only the dictionnaries of subcubes need to be ordered
+        returned_dict = {}
 
         dim_names = list(dim_names)
         next_dim_name = self._pop_first_dim(dim_names)
@@ -70,8 +223,9 @@ class CubeQueryMixin(object):
         if next_dim_name:
             #dictionnary containing *measures_dict* of the subcubes
             subcubes_dict = odict()
+            dim_index = self._meta.dim_indexes[next_dim_name]
             for subcube in self.subcubes(next_dim_name):
-                dim_value = subcube.constraint[next_dim_name]
+                dim_value = subcube._constraint[dim_index]
                 subcubes_dict[dim_value] = subcube.measures_dict(*dim_names, **kwargs)
             if full:
                 returned_dict['measure'] = self.measure()
@@ -82,6 +236,37 @@ class CubeQueryMixin(object):
             returned_dict['measure'] = self.measure()
         return returned_dict
 
+    def _flat_measures_dict(self, dim_names, full):
+        """
+        Returns:
+            odict. The measures in the format 'flat' of :meth:`measures_dict`.
+        """
+        axes = self._measures_axes(dim_names)
+
+        #measures for each level, i.e. with the *level* first dimensions fixed
+        if full:
+            levels = range(len(dim_names) + 1)
+        else:
+            levels = [len(dim_names)]
+        level_measures = {}
+        for level in levels:
+            if level == 0:
+                level_measures[level] = {(): self.measure()}
+            else:
+                level_measures[level] = dict(self._measures_cells(dim_names[:level], axes[:level]))
+
+        flat_dict = odict()
+        def fill(values, indexes):
+            level = len(indexes)
+            if level in level_measures:
+                key = tuple(values) + (ROLLUP,) * (len(dim_names) - level)
+                flat_dict[key] = level_measures[level].get(indexes, self.measure_none)
+            if level < len(dim_names):
+                for index, value in enumerate(axes[level]):
+                    fill(values + [value], indexes + (index,))
+        fill([], ())
+        return flat_dict
+
     def measures_list(self, *dim_names):
         """
         Returns:
@@ -109,13 +294,120 @@ class CubeQueryMixin(object):
                 returned_list.append(subcube.measure())
         return returned_list
 
-    def table_helper(self, *dim_names):
+    def measures_array(self, *dim_names, **kwargs):
+        """
+        Returns:
+            tuple. A tuple *(array, axes)*, where *array* is a multidimensionnal `numpy` array of measures from the cube, structured following *dim_names*, and *axes* is the list of the labels for each dimension of the array. For example :
+
+                >>> array, axes = cube.measures_array('dim2', 'dim1')
+                >>> axes == [[val2_1, val2_2, , val2_N], [val1_1, val1_2, , val1_N]]
+                True
+                >>> array[i, j] == cube.measure(dim2=axes[0][i], dim1=axes[1][j])
+                True
+
+            The labels are in the same order as in :meth:`measures_list`. The array is filled with *measure_none*, and then with all the measures calculated, with one grouped query if the cube has an *aggregate*.
+
+        Kwargs:
+            dtype (numpy.dtype): the data type of the array. Defaults to *float*.
+
+        .. note:: This method requires `numpy`.
+        """
+        dtype = kwargs.pop('dtype', float)
+        if kwargs:
+            raise TypeError("measures_array() got an unexpected keyword argument '%s'" % kwargs.keys()[0])
+        if numpy is None:
+            raise ImportError("'measures_array' requires numpy")
+        dim_names = list(dim_names)
+        axes = self._measures_axes(dim_names)
+
+        array = numpy.empty([len(axis) for axis in axes], dtype=dtype)
+        array.fill(self.measure_none)
+        for indexes, measure in self._measures_cells(dim_names, axes):
+            array[indexes] = measure
+        return array, axes
+
+    def measures_sparse(self, *dim_names):
+        """
+        Returns:
+            SparseMeasures. The measures from the cube, structured following *dim_names*, where only the measures that are not *measure_none* are stored. For example :
+
+                >>> sparse = cube.measures_sparse('dim2', 'dim1')
+                >>> sparse.measure(dim2=val2_1, dim1=val1_1) == cube.measure(dim2=val2_1, dim1=val1_1)
+                True
+                >>> sparse.to_measures_list() == cube.measures_list('dim2', 'dim1')
+                True
+
+            If the cube has an *aggregate*, the measures are calculated with one grouped query.
+        """
+        dim_names = list(dim_names)
+        axes = self._measures_axes(dim_names)
+        cells = [cell for cell in self._measures_cells(dim_names, axes) if cell[1] != self.measure_none]
+        cells.sort()
+        return SparseMeasures(dim_names, axes, cells, measure_none=self.measure_none)
+
+    def _measures_axes(self, dim_names):
+        """
+        Returns:
+            list. For each dimension in *dim_names*, the list of its values in the same order as the subcubes.
+        """
+        axes = []
+        for dim_name in dim_names:
+            axes.append([value[dim_name] for value in self._sorted_sample_space(dim_name)])
+        return axes
+
+    def _measures_cells(self, dim_names, axes, batch_size=100):
+        """
+        Calculates the measures for all the combinations of values in *axes*. This method can be overriden to calculate the measures more efficiently.
+
+        Args:
+            dim_names (list). The names of the dimensions of *axes*.
+            axes (list). For each dimension, the list of its values.
+
+        Returns:
+            iterator. An iterator on tuples *(indexes, measure)*, where *indexes* are the indexes of the subcube's coordinates in *axes*. The cells whose measure is *measure_none* can be omitted.
+        """
+        #all the batches are calculated by the same worker threads
+        pool = self._worker_pool()
+        try:
+            batch = []
+            for indexes in product(*[range(len(axis)) for axis in axes]):
+                batch.append(indexes)
+                if len(batch) == batch_size:
+                    for cell in self._measures_cells_batch(dim_names, axes, batch, pool=pool):
+                        yield cell
+                    batch = []
+            for cell in self._measures_cells_batch(dim_names, axes, batch, pool=pool):
+                yield cell
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def _measures_cells_batch(self, dim_names, axes, indexes_list, pool=None):
+        """
+        Returns:
+            list. The tuples *(indexes, measure)* for all the indexes in *indexes_list*.
+        """
+        coordinates_list = []
+        for indexes in indexes_list:
+            coordinates_list.append(dict([
+                (dim_name, axis[index]) for dim_name, axis, index in zip(dim_names, axes, indexes)
+            ]))
+        return zip(indexes_list, self._measures_batch(dim_names, coordinates_list, pool=pool))
+
+    def table_helper(self, *dim_names, **kwargs):
         """
         A helper function to build a table from a cube. It takes two dimensions, and creates a dictionnary from it.  
 
         Args:
             dim_names. Two dimension names "dimension1", "dimension2", where "dimension1" is the name of the dimension that will be used for columns, "dimension2" the name of the dimension for rows.
 
+        Kwargs:
+            col_offset (int): index of the first column of the table. Defaults to 0.
+            col_limit (int|None): maximum number of columns in the table. Defaults to None, i.e. all the columns.
+            row_offset (int): index of the first row of the table. Defaults to 0.
+            row_limit (int|None): maximum number of rows in the table. Defaults to None, i.e. all the rows.
+            totals (bool): if False, the overalls are not calculated, and are all *None* in the returned dictionnary. You can then get them separately with :meth:`table_totals`. Defaults to True.
+
         Returns:
             dict. A dictionnary containing the following variables :
 
@@ -128,56 +420,68 @@ class CubeQueryMixin(object):
                 - col_dim_name: the dimension on which the columns are calculated
                 - row_dim_name: the dimension on which the rows are calculated
                 - overall: measure on the whole cube
+                - col_offset, row_offset: index of the first column and of the first row of the table
+                - col_count, row_count: total number of columns and rows, regardless of *col_limit* and *row_limit*
+
+            Only the cells inside the window defined by *col_offset*, *col_limit*, *row_offset* and *row_limit* are calculated.
         """
-        col_names = []
-        row_names = []
-        cols = []
-        rows = []
-        row_overalls = []
-        col_overalls = []
+        totals = kwargs.pop('totals', True)
         col_dim_name = str(dim_names[0])
         row_dim_name = str(dim_names[1])
-        overall = None
+        window = self._table_window(col_dim_name, row_dim_name, **kwargs)
+        col_subcubes, row_subcubes = window['col_subcubes'], window['row_subcubes']
+
+        #cell level variables, each cell is calculated only once, and all the cells are calculated together
+        col_values = [col_subcube._bound_dimension(col_dim_name).constraint for col_subcube in col_subcubes]
+        row_values = [row_subcube._bound_dimension(row_dim_name).constraint for row_subcube in row_subcubes]
+        #the cells and the totals are calculated by the same worker threads
+        pool = self._worker_pool()
+        try:
+            measures = self._measures_batch([col_dim_name, row_dim_name], [
+                {col_dim_name: col_value, row_dim_name: row_value}
+                for col_value in col_values for row_value in row_values
+            ], pool=pool)
+            if totals:
+                overalls = self._table_totals(col_dim_name, row_dim_name, col_subcubes, row_subcubes, pool=pool)
+            else:
+                overalls = {
+                    'col_overalls': [None] * len(col_subcubes),
+                    'row_overalls': [None] * len(row_subcubes),
+                    'overall': None,
+                }
+        finally:
+            if pool is not None:
+                pool.close()
+        values = [measures[col_index * len(row_values):(col_index + 1) * len(row_values)]
+            for col_index in range(len(col_values))]
+
+        #the labels of each axis are resolved together
+        col_labels = self._bound_dimension(col_dim_name).pretty_constraints(col_values)
+        row_labels = self._bound_dimension(row_dim_name).pretty_constraints(row_values)
 
         #columns variables in the context
-        for col_subcube in self.subcubes(col_dim_name):
-            col_dimension = col_subcube.dimensions[col_dim_name]
-            #column level variables
-            col_names.append((
-                col_dimension.constraint,
-                col_dimension.pretty_constraint
-            ))
-            col_overalls.append(col_subcube.measure())
-            col = {
-                'values': [],
-                'overall': col_subcube.measure(),
-                'name': col_dimension.constraint, 
-                'pretty_name': col_dimension.pretty_constraint,
-            }
-            #cell level variables
-            for cell_subcube in col_subcube.subcubes(row_dim_name):
-                col['values'].append(cell_subcube.measure())
-            cols.append(col)
+        col_names = []
+        cols = []
+        for col_index, (col_value, col_label) in enumerate(zip(col_values, col_labels)):
+            col_names.append((col_value, col_label))
+            cols.append({
+                'values': values[col_index],
+                'overall': overalls['col_overalls'][col_index],
+                'name': col_value, 
+                'pretty_name': col_label,
+            })
 
         #rows variables in the context
-        for row_subcube in self.subcubes(row_dim_name):
-            row_dimension = row_subcube.dimensions[row_dim_name]
-            #row level variables
-            row_names.append((
-                row_dimension.constraint,
-                row_dimension.pretty_constraint
-            ))
-            row_overalls.append(row_subcube.measure())
-            row = {
-                'values': [],
-                'overall': row_subcube.measure(),
-                'name': row_dimension.constraint, 
-                'pretty_name': row_dimension.pretty_constraint,
-            }
-            #cell level variables
-            for cell_subcube in row_subcube.subcubes(col_dim_name):
-                row['values'].append(cell_subcube.measure())
-            rows.append(row)
+        row_names = []
+        rows = []
+        for row_index, (row_value, row_label) in enumerate(zip(row_values, row_labels)):
+            row_names.append((row_value, row_label))
+            rows.append({
+                'values': [column[row_index] for column in values],
+                'overall': overalls['row_overalls'][row_index],
+                'name': row_value, 
+                'pretty_name': row_label,
+            })
 
         #context dict
         return {
@@ -185,10 +489,64 @@ class CubeQueryMixin(object):
             'row_names': row_names,
             'cols': cols,
             'rows': rows,
-            'row_overalls': row_overalls,
-            'col_overalls': col_overalls,
+            'row_overalls': overalls['row_overalls'],
+            'col_overalls': overalls['col_overalls'],
             'col_dim_name': col_dim_name,
             'row_dim_name': row_dim_name,
+            'overall': overalls['overall'],
+            'col_offset': window['col_offset'],
+            'row_offset': window['row_offset'],
+            'col_count': window['col_count'],
+            'row_count': window['row_count'],
+        }
+
+    def table_totals(self, *dim_names, **kwargs):
+        """
+        Calculates only the overalls of the table built by :meth:`table_helper`. It takes the same arguments, except for *totals*. 
+
+        Returns:
+            dict. A dictionnary containing the variables *col_overalls*, *row_overalls* and *overall*, as described in :meth:`table_helper`.
+        """
+        col_dim_name = str(dim_names[0])
+        row_dim_name = str(dim_names[1])
+        window = self._table_window(col_dim_name, row_dim_name, **kwargs)
+        pool = self._worker_pool()
+        try:
+            return self._table_totals(col_dim_name, row_dim_name, window['col_subcubes'], window['row_subcubes'], pool=pool)
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def _table_window(self, col_dim_name, row_dim_name, col_offset=0, col_limit=None, row_offset=0, row_limit=None):
+        """
+        Returns:
+            dict. The subcubes for the columns and the rows of the table that are inside the window, and the information on the window.
+        """
+        col_sample_space = self._sorted_sample_space(col_dim_name)
+        row_sample_space = self._sorted_sample_space(row_dim_name)
+        col_stop = col_offset + col_limit if col_limit is not None else None
+        row_stop = row_offset + row_limit if row_limit is not None else None
+        return {
+            'col_subcubes': [self.constrain(**value) for value in col_sample_space[col_offset:col_stop]],
+            'row_subcubes': [self.constrain(**value) for value in row_sample_space[row_offset:row_stop]],
+            'col_offset': col_offset,
+            'row_offset': row_offset,
+            'col_count': len(col_sample_space),
+            'row_count': len(row_sample_space),
+        }
+
+    def _table_totals(self, col_dim_name, row_dim_name, col_subcubes, row_subcubes, pool=None):
+        """
+        Returns:
+            dict. The overalls of the columns *col_subcubes*, of the rows *row_subcubes*, and of the whole cube, calculated by *pool* if given (see :meth:`_worker_pool`).
+        """
+        return {
+            'col_overalls': self._measures_batch([col_dim_name], [
+                {col_dim_name: col_subcube._bound_dimension(col_dim_name).constraint} for col_subcube in col_subcubes
+            ], pool=pool),
+            'row_overalls': self._measures_batch([row_dim_name], [
+                {row_dim_name: row_subcube._bound_dimension(row_dim_name).constraint} for row_subcube in row_subcubes
+            ], pool=pool),
             'overall': self.measure(),
         }
     
@@ -202,10 +560,77 @@ class CubeQueryMixin(object):
                 ...     , ,
                 ...     {'dim1': val1_N, 'dim2': val2_N, '__measure': measure_1_1}]
         """
-        dim_names = list(dim_names)
+        return list(self.measures_iter(*dim_names))
+
+    def measures_iter(self, *dim_names, **kwargs):
+        """
+        Returns:
+            iterator. An iterator on the same dictionnaries as :meth:`measures`, in the same order. The measures are calculated lazily, by batches of subcubes, and the sample space of the first dimension is streamed from the database (see :meth:`cube.models.Dimension.iter_sample_space`).
+
+        Kwargs:
+            batch_size (int): the number of subcubes whose measures are calculated together. Defaults to 100.
+        """
+        batch_size = kwargs.get('batch_size', 100)
+        free_dim_names = self._free_dim_names(*dim_names)
+
+        #if no free dimension, the cube is completely constrained
+        if not free_dim_names:
+            measure_dict = self.constraint
+            measure_dict['__measure'] = self.measure()
+            yield measure_dict
+            raise StopIteration
+
+        #all the batches are calculated by the same worker threads
+        pool = self._worker_pool()
+        try:
+            batch = []
+            for value in self._iter_sorted_sample_space(*free_dim_names):
+                batch.append(value)
+                if len(batch) == batch_size:
+                    for measure_dict in self._measures_dicts(free_dim_names, batch, pool=pool):
+                        yield measure_dict
+                    batch = []
+            for measure_dict in self._measures_dicts(free_dim_names, batch, pool=pool):
+                yield measure_dict
+        finally:
+            if pool is not None:
+                pool.close()
+        raise StopIteration
+
+    def _measures_dicts(self, dim_names, coordinates_list, pool=None):
+        """
+        Returns:
+            list. The dictionnaries of :meth:`measures` for the subcubes at *coordinates_list*.
+        """
+        measures = self._measures_batch(dim_names, coordinates_list, pool=pool)
+        constraint_key = self.constraint_key
         dict_list = []
-        for subcube in self.subcubes(*dim_names):
-            measure_dict = subcube.constraint
-            measure_dict['__measure'] = subcube.measure()
+        for coordinates, measure in zip(coordinates_list, measures):
+            measure_dict = dict(constraint_key)
+            measure_dict.update(coordinates)
+            measure_dict['__measure'] = measure
             dict_list.append(measure_dict)
         return dict_list
+
+    def _worker_pool(self):
+        """
+        Returns:
+            WorkerPool|None. A :class:`cube.parallel.WorkerPool` shared by all the batches of one iteration over the measures, or None if the measures are calculated in the current thread. The caller closes the pool.
+        """
+        return None
+
+    def _measures_batch(self, dim_names, coordinates_list, pool=None):
+        """
+        Calculates the measures of several subcubes at once. This method can be overriden to calculate all the measures more efficiently than one by one.
+
+        Args:
+            dim_names (list). The names of the dimensions that are used in the coordinates.
+            coordinates_list (list). The coordinates of the subcubes, as *[{'dim_name1': val1, 'dim_name2': val2, ...}, ...]*.
+
+        Kwargs:
+            pool (WorkerPool): the pool returned by :meth:`_worker_pool`, if any.
+
+        Returns:
+            list. The measures of the subcubes, in the same order as *coordinates_list*.
+        """
+        return [self.constrain(**coordinates).measure() for coordinates in coordinates_list]
@@ -1,36 +1,78 @@
 import re
-import copy
 
-from django.template import Node, NodeList, TemplateSyntaxError, Library, Variable, Context, VariableDoesNotExist
+from django.template import Node, TemplateSyntaxError, Library, Variable, VariableDoesNotExist
 from django.template.loader  import get_template
+from django.utils.safestring import mark_safe
 from django.conf import settings
 
+from cube.cache import cached_fragment
+
 register = Library()
 
+#separator of the dimensions in the arguments of the tags
+_dimensions_sep_re = re.compile(r' *, *')
+
+def _compile_argument(parser, bit):
+    """
+    Returns:
+        str|FilterExpression. The argument *bit* of a tag. If it is a literal string, it is resolved once for all at parse time, otherwise it is compiled into a filter expression.
+    """
+    expression = parser.compile_filter(bit)
+    if expression.var is not None and not isinstance(expression.var, Variable) and not expression.filters:
+        return str(expression.var)
+    return expression
+
+def _resolve_argument(argument, context):
+    """
+    Returns:
+        object. The value of *argument* (see :func:`_compile_argument`) in *context*.
+
+    Raises:
+        VariableDoesNotExist. If the argument cannot be resolved.
+    """
+    if isinstance(argument, basestring):
+        return argument
+    value = argument.resolve(context, True)
+    if value is None:
+        raise VariableDoesNotExist("Failed lookup for '%s'", (argument.token,))
+    return value
+
 
 class TableFromCubeNode(Node):
-    def __init__(self, cube, dimensions, filepath):
+    def __init__(self, cube, dimensions, filepath, cache_timeout=None, vary_on=()):
         self.filepath = filepath
         self.dimensions, self.cube = dimensions, cube
+        self.cache_timeout = cache_timeout
+        self.vary_on = vary_on
+        #the templates already loaded by the node
+        self._templates = {}
+
+    def get_template(self, filepath):
+        """
+        Returns:
+            Template. The template *filepath*, loaded only once by the node.
+        """
+        try:
+            return self._templates[filepath]
+        except KeyError:
+            template = get_template(filepath)
+            self._templates[filepath] = template
+            return template
 
     def render(self, context):
 
         #resolve filename
-        matched = re.match('(?P<quote>"|\')(?P<literal>\w+)(?P=quote)', self.filepath)
-        if matched:
-            filepath = matched.group('literal')
-        else:
-            try:
-                filepath = Variable(self.filepath).resolve(context)
-            except VariableDoesNotExist:
-                if settings.DEBUG:
-                    return "[couldn't resolve file path]"
-                else:
-                    return ''
+        try:
+            filepath = _resolve_argument(self.filepath, context)
+        except VariableDoesNotExist:
+            if settings.DEBUG:
+                return "[couldn't resolve file path]"
+            else:
+                return ''
         
         #resolve cube from context
         try:
-            cube = self.cube.resolve(context, False)
+            cube = _resolve_argument(self.cube, context)
         except VariableDoesNotExist:
             if settings.DEBUG:
                 return "[couldn't resolve cube]"
@@ -38,20 +80,36 @@ class TableFromCubeNode(Node):
                 return ''
 
         #resolve dimensions
-        dimensions = []
-        for dimension in self.dimensions:
-            matched = re.match('(?P<quote>"|\')(?P<literal>\w+)(?P=quote)', dimension)
-            if matched:
-                dimensions.append(matched.group('literal'))
+        try:
+            dimensions = [_resolve_argument(dimension, context) for dimension in self.dimensions]
+        except VariableDoesNotExist:
+            if settings.DEBUG:
+                return "[couldn't resolve dimension]"
             else:
-                try:
-                    dimensions.append(Variable(dimension).resolve(context))
-                except VariableDoesNotExist:
-                    if settings.DEBUG:
-                        return "[couldn't resolve dimension]"
-                    else:
-                        return ''
+                return ''
+
+        #resolve cache timeout
+        try:
+            cache_timeout = self.cache_timeout and int(_resolve_argument(self.cache_timeout, context))
+        except (VariableDoesNotExist, ValueError):
+            if settings.DEBUG:
+                return "[couldn't resolve cache timeout]"
+            else:
+                return ''
 
+        if not cache_timeout:
+            return self.render_table(context, cube, dimensions, filepath)
+
+        #resolve the other variables that the cached table depends on, a missing variable being None
+        vary_on = tuple([variable.resolve(context, True) for variable in self.vary_on])
+        return cached_fragment(cube, dimensions, filepath,
+            lambda: self.render_table(context, cube, dimensions, filepath), cache_timeout, vary_on)
+
+    def render_table(self, context, cube, dimensions, filepath):
+        """
+        Returns:
+            unicode. The table of *cube* by *dimensions*, rendered with the template *filepath*.
+        """
         #build context
         try:
             extra_context = cube.table_helper(*dimensions)
@@ -62,13 +120,14 @@ class TableFromCubeNode(Node):
             else:
                 return ''
 
-        #rendering template
+        #rendering template, with the table's variables pushed on top of the context
         try:
-            new_context = copy.copy(context)
-            new_context.update(extra_context)
-            t = get_template(filepath)
-            c = Context(new_context)
-            return t.render(c)
+            t = self.get_template(filepath)
+            context.update(extra_context)
+            try:
+                return t.render(context)
+            finally:
+                context.pop()
         except TemplateSyntaxError, e:
             if settings.TEMPLATE_DEBUG:
                 raise
@@ -81,12 +140,16 @@ def do_tablefromcube(parser, token):
     """
     Inclusion tag to render a table using a defined template. Usage : ::
     
-        {% tablefromcube <cube> by <dimension1>, <dimension2> using <template_name> %}
+        {% tablefromcube <cube> by <dimension1>, <dimension2> using <template_name> [cache <timeout> [<variable1> ... <variableN>]] %}
 
     For example : ::
     
         {% tablefromcube my_cube by some_dimension, "some_other_dimension" using "mytable.html" %}
 
+    With *cache*, the rendered table is cached for *timeout* seconds, or until the data of the cube changes (see :mod:`cube.cache`). The cached table only depends on the cube, the dimensions and the template : if the template uses other variables of the context, for example the current user, they must be given after the timeout, so that a table is cached for each of their values : ::
+
+        {% tablefromcube my_cube by some_dimension, "some_other_dimension" using "mytable.html" cache 600 request.user.pk %}
+
     The context with which this template is rendered contains the variables :
 
         - col_names: list of tuples *(<column name>, <column pretty name>)*
@@ -105,7 +168,14 @@ def do_tablefromcube(parser, token):
     tagname = bits[0]
     by_index = 2
     using_index = 5
-    filepath_index = -1
+    filepath_index = 6
+
+    cache_timeout = None
+    vary_on = ()
+    if len(bits) >= 9 and bits[7] == 'cache':
+        cache_timeout = _compile_argument(parser, bits[8])
+        vary_on = [parser.compile_filter(bit) for bit in bits[9:]]
+        bits = bits[:7]
 
     if not len(bits) == 7:
         raise TemplateSyntaxError("'%s' tag should have seven words: %s" % (tagname, token.contents))
@@ -115,19 +185,128 @@ def do_tablefromcube(parser, token):
                                   "not at the expected position %s" % (tagname, token.contents))
 
     #trim the spaces around comas, and then split the list to have all the dimensions
-    dimensions = re.sub(r' *, *', ',', ' '.join(bits[by_index + 1:using_index])).split(',')
+    dimensions = _dimensions_sep_re.sub(',', ' '.join(bits[by_index + 1:using_index])).split(',')
     for dim in dimensions:
         if not dim or ' ' in dim:
             raise TemplateSyntaxError("'%s' tag received an invalid argument:"
                                       " %s" % (tagname, token.contents))
 
-    #turns the cube argument into a template.Variable
+    #the literal arguments are resolved now, the others are turned into filter expressions
     cube = parser.compile_filter(bits[1])
+    dimensions = [_compile_argument(parser, dim) for dim in dimensions]
+    filepath = _compile_argument(parser, bits[filepath_index])
 
-    return TableFromCubeNode(cube, dimensions, bits[filepath_index])
+    return TableFromCubeNode(cube, dimensions, filepath, cache_timeout, vary_on)
 do_tablefromcube = register.tag('tablefromcube', do_tablefromcube)
 
 
+class _MeasuresLoader(object):
+    """
+    Calculates together the measures of all the subcubes of *cube* at *coordinates_list*, the first time that one of them is read.
+
+    The loaders of nested *subcubes* tags are children of the loader of the enclosing tag, so that all the measures of one nesting level are calculated together as well.
+    """
+    def __init__(self, cube, dim_names, coordinates_list, subcubes, width=1):
+        self.cube = cube
+        self.dim_names = dim_names
+        self.coordinates_list = coordinates_list
+        self.subcubes = subcubes
+        #number of subcubes for each subcube of the parent loader
+        self.width = width
+        self._measures = None
+        self._children = {}
+        self._labels = {}
+
+    @classmethod
+    def for_cube(cls, cube, dim_names):
+        """
+        Returns:
+            _MeasuresLoader. The loader for the subcubes of *cube* by *dim_names*.
+        """
+        free_dim_names = cube._free_dim_names(*dim_names)
+        values = cube._sorted_sample_space(*free_dim_names) if free_dim_names else [{}]
+        return cls(cube, free_dim_names, values, [cube.constrain(**value) for value in values])
+
+    def child(self, dim_names):
+        """
+        Returns:
+            _MeasuresLoader. The loader for the subcubes by *dim_names* of all the subcubes of this loader.
+        """
+        dim_names = tuple(dim_names)
+        if dim_names in self._children:
+            return self._children[dim_names]
+
+        #all the subcubes of the loader have the same free dimensions, and therefore the same sample space
+        if self.subcubes:
+            free_dim_names = self.subcubes[0]._free_dim_names(*dim_names)
+            values = self.subcubes[0]._sorted_sample_space(*free_dim_names) if free_dim_names else [{}]
+        else:
+            free_dim_names, values = [], []
+        coordinates_list = []
+        subcubes = []
+        for coordinates, subcube in zip(self.coordinates_list, self.subcubes):
+            for value in values:
+                child_coordinates = dict(coordinates)
+                child_coordinates.update(value)
+                coordinates_list.append(child_coordinates)
+                subcubes.append(subcube.constrain(**value))
+
+        child = _MeasuresLoader(self.cube, list(self.dim_names) + free_dim_names, coordinates_list, subcubes, len(values))
+        self._children[dim_names] = child
+        return child
+
+    def measure(self, index):
+        """
+        Returns:
+            object. The measure of the subcube at *index*.
+        """
+        if self._measures is None:
+            if self.dim_names:
+                self._measures = self.cube._measures_batch(self.dim_names, self.coordinates_list)
+            else:
+                self._measures = [self.cube.measure()] * len(self.coordinates_list)
+        return self._measures[index]
+
+    def pretty_constraint(self, index, dim_name):
+        """
+        Returns:
+            object. The pretty constraint of the dimension *dim_name* of the subcube at *index*. The pretty constraints of all the subcubes of the loader are resolved together, with :meth:`cube.base.BaseDimension.pretty_constraints`.
+        """
+        if dim_name not in self._labels:
+            dim_index = self.cube._meta.dim_indexes[dim_name]
+            values = [subcube._constraint[dim_index] for subcube in self.subcubes]
+            self._labels[dim_name] = self.cube._bound_dimension(dim_name).pretty_constraints(values)
+        return self._labels[dim_name][index]
+
+    def lazy_subcubes(self, start=0, stop=None):
+        """
+        Returns:
+            list. The subcubes of the loader from *start* to *stop*, as :class:`_LazySubcube`.
+        """
+        if stop is None:
+            stop = len(self.subcubes)
+        return [_LazySubcube(self.subcubes[index], self, index) for index in range(start, stop)]
+
+class _LazySubcube(object):
+    """
+    A proxy to a subcube, yielded by the *subcubes* tag. Its measure is calculated by its :class:`_MeasuresLoader`.
+    """
+    def __init__(self, subcube, loader, index):
+        self._subcube = subcube
+        self._loader = loader
+        self._index = index
+
+    def measure(self, **coordinates):
+        if coordinates:
+            return self._subcube.measure(**coordinates)
+        return self._loader.measure(self._index)
+
+    def __getattr__(self, name):
+        return getattr(self._subcube, name)
+
+    def __repr__(self):
+        return repr(self._subcube)
+
 class SubcubesNode(Node):
 
     def __init__(self, cube, dimensions, subcube_var, nodelist):
@@ -137,39 +316,38 @@ class SubcubesNode(Node):
 
     def __repr__(self):
         return "<Subcube Node: %s by %s as %s>" % \
-            (self.cube, ', '.join(self.dimensions), self.subcube_var)
+            (self.cube, ', '.join([getattr(dim, 'token', dim) for dim in self.dimensions]), self.subcube_var)
 
     def __iter__(self):
         for node in self.nodelist:
             yield node
 
     def render(self, context):
-        #resolve cube from context
+        #resolve cube and dimensions from context
         try:
-            cube = self.cube.resolve(context, False)
+            cube = _resolve_argument(self.cube, context)
+            dimensions = [str(_resolve_argument(dimension, context)) for dimension in self.dimensions]
         except VariableDoesNotExist:
             return ''
 
-        #resolve dimensions
-        dimensions = []
-        for dimension in self.dimensions:
-            matched = re.match('(?P<quote>"|\')(?P<literal>\w+)(?P=quote)', dimension)
-            if matched:
-                dimensions.append(str(matched.group('literal')))
-            else:
-                try:
-                    dimensions.append(str(Variable(dimension).resolve(context)))
-                except VariableDoesNotExist:
-                    return ''
-
-        #loop subcubes and render nodes
-        nodelist = NodeList()
-        for subcube in cube.subcubes(*dimensions):
-            context[self.subcube_var] = subcube
-            for node in self.nodelist:
-                nodelist.append(node.render(context))
+        #the subcubes yielded give lazy measures, calculated together for all the subcubes of the same nesting level
+        if isinstance(cube, _LazySubcube):
+            loader = cube._loader.child(dimensions)
+            start = cube._index * loader.width
+            subcubes = loader.lazy_subcubes(start, start + loader.width)
+        else:
+            subcubes = _MeasuresLoader.for_cube(cube, dimensions).lazy_subcubes()
 
-        return nodelist.render(context)
+        #loop subcubes and render nodes, in a new layer of the context
+        bits = []
+        context.push()
+        try:
+            for subcube in subcubes:
+                context[self.subcube_var] = subcube
+                bits.append(self.nodelist.render(context))
+        finally:
+            context.pop()
+        return mark_safe(''.join(bits))
 
 
 def do_subcubes(parser, token):
@@ -222,7 +400,7 @@ def do_subcubes(parser, token):
                                   " '%s cube by dimension as subcube': %s" % (tagname, tagname, token.contents))
 
     #trim the spaces around comas, and then split the list to have all the dimensions
-    dimensions = re.sub(r' *, *', ',', ' '.join(bits[by_index + 1:as_index])).split(',')
+    dimensions = _dimensions_sep_re.sub(',', ' '.join(bits[by_index + 1:as_index])).split(',')
     for dim in dimensions:
         if not dim or ' ' in dim:
             raise TemplateSyntaxError("'%s' tag received an invalid argument:"
@@ -231,8 +409,9 @@ def do_subcubes(parser, token):
     #name of the variable that will contain the subcube
     subcube_var = bits[-1]
 
-    #turns the cube argument into a template.Variable
+    #the literal arguments are resolved now, the others are turned into filter expressions
     cube = parser.compile_filter(bits[1])
+    dimensions = [_compile_argument(parser, dim) for dim in dimensions]
 
     #gets all the nodes contained in the tag
     nodelist = parser.parse(('end%s' % tagname,))
@@ -249,7 +428,11 @@ def prettyconstraint(cube, dim_name):
     Filter to get the value of the constraint for a dimension. Use it as : ::
         
         {{ cube|prettyconstraint:'dimension_name' }}
+
+    For the subcubes yielded by the tag *subcubes*, the values of all the subcubes of the tag are resolved together.
     """
+    if isinstance(cube, _LazySubcube) and dim_name in cube._meta.dim_indexes:
+        return cube._loader.pretty_constraint(cube._index, dim_name)
     return cube.dimensions[dim_name].pretty_constraint
 
 register.filter('prettyconstraint', prettyconstraint)
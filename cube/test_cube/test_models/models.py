@@ -2,7 +2,8 @@
 .. 
     >>> from datetime import datetime, date
     >>> from cube.models import Cube, Dimension
-    >>> from cube.views import table_from_cube
+    >>> from cube.views import table_from_cube, measures_export, measures_json
+    >>> from django.db.models import Count
     >>> import copy
 
 .. currentmodule:: cube
@@ -78,20 +79,34 @@ Dimension
     True
 
     ----- Formatting datetimes constraint
-    >>> d = Dimension(field='attribute__date__absmonth')
-    >>> d.constraint = date(3000, 7, 1)
+    >>> d = Dimension(field='attribute__date__absmonth')._bind(date(3000, 7, 1))
     >>> d.to_queryset_filter() == {'attribute__date__month': 7, 'attribute__date__year': 3000}
     True
-    >>> d = Dimension(field='attribute__date__absday')
-    >>> d.constraint = datetime(1990, 8, 23, 0, 0, 0)
+    >>> d = Dimension(field='attribute__date__absday')._bind(datetime(1990, 8, 23, 0, 0, 0))
     >>> d.to_queryset_filter() == {'attribute__date__day': 23, 'attribute__date__month': 8, 'attribute__date__year': 1990}
     True
     >>> d = Dimension()
     >>> d._name = 'myname'
-    >>> d.constraint = 'coucou'
+    >>> d = d._bind('coucou')
     >>> d.to_queryset_filter() == {'myname': 'coucou'}
     True
 
+    ----- Lookups are compiled once, and shared by the copies of the dimension
+    >>> d = Dimension(field='author__instrument__name', queryset=Song.objects.all())
+    >>> bound_d = d._bind('piano')
+    >>> bound_d.to_queryset_filter() == {'author__instrument__name': 'piano'}
+    True
+    >>> path = d._compiled_path(Song)
+    >>> [key for key, field in path.hops], path.kind, path.key
+    (['author', 'instrument'], 'values', 'name')
+    >>> bound_d._compiled_path(Song) is path ; d._compiled_lookup() is bound_d._compiled_lookup()
+    True
+    True
+    >>> Dimension(field='author__nofield', queryset=Song.objects.all()).get_sample_space()
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid field 'author__nofield', because 'nofield' is an invalid field name for <class 'test_cube.test_models.models.Musician'>
+
 Setting a dimension's sample space
 ---------------------------------------
 
@@ -161,6 +176,69 @@ and refer to any type of field, even a django object
     ... ]
     True
 
+..
+    ----- The objects of a foreign model are taken with one query, sorted by the database
+    >>> from django.conf import settings
+    >>> from django.db import connection
+    >>> settings.DEBUG, queries_before = True, len(connection.queries)
+    >>> d = Dimension(field='author__instrument', queryset=Song.objects.all())
+    >>> list(d.get_sample_space()) == [trumpet, piano], len(connection.queries) - queries_before
+    (True, 1)
+    >>> 'ORDER BY' in connection.queries[-1]['sql']
+    True
+    >>> d = Dimension(field='author__instrument__name', queryset=Song.objects.all())
+    >>> sorted(d.get_sample_space()) == ['piano', 'trumpet'], len(connection.queries) - queries_before
+    (True, 2)
+    >>> settings.DEBUG = False
+
+Sorting a dimension's sample space
+-----------------------------------
+
+The sample space of a dimension is sorted by the database. By default, the values are in ascending order, and the objects of a foreign model are sorted by their *pk*. The parameter *order_by* changes this order, like *QuerySet.order_by* :
+
+    >>> d = Dimension(field='author__instrument', queryset=Song.objects.all(), order_by='name')
+    >>> list(d.get_sample_space()) == [piano, trumpet]
+    True
+    >>> d = Dimension(field='author__firstname', queryset=Song.objects.all(), order_by='-author__firstname')
+    >>> list(d.get_sample_space()) == ['Thelonious', 'Miles', 'Freddie', 'Bill']
+    True
+
+The parameter *nulls* puts *None* at the beginning or at the end of the sample space, with 'first' or 'last'.
+
+..
+    ----- order_by and nulls
+    >>> Dimension(field='author__firstname', queryset=Song.objects.all(), order_by='title').get_sample_space()
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid order_by 'title', the values of 'author__firstname' can only be sorted by themselves
+    >>> Dimension(field='author__firstname', nulls='middle')
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid value 'middle' for 'nulls', must be 'first' or 'last'
+    >>> Dimension(field='author__firstname', queryset=Song.objects.all(), nulls='last').get_sample_space() == ['Bill', 'Freddie', 'Miles', 'Thelonious']
+    True
+    >>> Dimension(field='release_date__absmonth', queryset=Song.objects.all(), order_by='-release_date__absmonth').get_sample_space() == [
+    ...     datetime(1969, 1, 1), datetime(1959, 8, 1), datetime(1945, 2, 1), datetime(1944, 2, 1)]
+    True
+    >>> Dimension(field='release_date__year', queryset=Song.objects.all(), order_by='-release_date__year').get_sample_space(sort=True)
+    [1969, 1959, 1945, 1944]
+    >>> class YearSongCube(Cube):
+    ...     year = Dimension(field='release_date__year', order_by='-release_date__year')
+    ...     title = Dimension()
+    ...     @staticmethod
+    ...     def aggregation(queryset):
+    ...         return queryset.count()
+    >>> year_c = YearSongCube(Song.objects.all())
+    >>> [subcube.constraint['year'] for subcube in year_c.subcubes('year')], list(year_c.dimensions['year'].iter_sample_space())
+    ([1969, 1959, 1945, 1944], [1969, 1959, 1945, 1944])
+    >>> [col['name'] for col in year_c.table_helper('year', 'title')['cols']]
+    [1969, 1959, 1945, 1944]
+    >>> class OrderedSongCube(Cube):
+    ...     author = Dimension(order_by='-lastname')
+    ...     title = Dimension(order_by='-title')
+    >>> [(subcube.constraint['author'].lastname, subcube.constraint['title']) for subcube in OrderedSongCube(Song.objects.filter(author__lastname__in=['Monk', 'Davis'])).subcubes('author', 'title')][:3]
+    [(u'Monk', u"Well You Needn't"), (u'Monk', u'So What'), (u'Monk', u'Blue Monk')]
+
 Giving dimension's sample space as a callable
 ---------------------------------------------
 
@@ -188,6 +266,17 @@ Overriding the display of dimension's value
     ...     def pretty_constraint(self):
     ...         return self.constraint.name.capitalize()
 
+When a whole axis is displayed, for example by :meth:`Cube.table_helper`, the labels are taken from :meth:`Dimension.pretty_constraints`, with all the values of the axis. Override it to get all the labels with one query, for example for a dimension on the ids of instruments :
+
+    >>> class InstrumentIdDimension(Dimension):
+    ...     @property
+    ...     def pretty_constraint(self):
+    ...         return self.pretty_constraints([self.constraint])[0]
+    ...
+    ...     def pretty_constraints(self, values):
+    ...         instruments = Instrument.objects.in_bulk([value for value in values if value])
+    ...         return [value and instruments[value].name.capitalize() for value in values]
+
 Cube
 ======
 
@@ -252,10 +341,140 @@ Declaring a cube is very similar to declaring a Django model, with dimensions in
     True
     >>> c_copy.constraint == c.constraint
     True
-    >>> id(c_copy.queryset) != id(c.queryset) ; list(c_copy.queryset) == list(c.queryset)
+    >>> copy_queryset, queryset = c_copy.queryset, c.queryset
+    >>> id(copy_queryset) != id(queryset) ; list(copy_queryset) == list(queryset)
     True
     True
 
+    ----- Compact subcubes
+    >>> subcube = c.constrain(firstname='Miles', lastname='Davis')
+    >>> class CompactCube(Cube):
+    ...     __slots__ = ()
+    ...     firstname = Dimension()
+    >>> hasattr(CompactCube(Musician.objects.all()).constrain(firstname='Miles'), '__dict__'), hasattr(subcube, '__dict__')
+    (False, True)
+    >>> subcube._constraint == ('Miles', None, None, None, 'Davis')
+    True
+    >>> subcube.dimensions['firstname'].constraint, subcube.dimensions['instrument'].constraint
+    ('Miles', None)
+    >>> MusicianCube._meta.dimensions['firstname'].constraint is None
+    True
+
+    ----- Immutable cubes, that can be shared
+    >>> c.queryset is c.queryset
+    False
+    >>> c.queryset = Musician.objects.none()
+    Traceback (most recent call last):
+    ...
+    AttributeError: can't set attribute
+    >>> subcube.dimensions['firstname'].constraint = 'Bill'
+    Traceback (most recent call last):
+    ...
+    AttributeError: can't set attribute
+    >>> shared_c = MusicianCube(Musician.objects.all())
+    >>> shared_c.measures('firstname') == c.measures('firstname') ; shared_c.get_sample_space('instrument') == c.get_sample_space('instrument')
+    True
+    True
+    >>> shared_c._queryset._result_cache is None, shared_c.dimensions['firstname'].queryset._result_cache is None
+    (True, True)
+    >>> import threading
+    >>> racing_c, bound = MusicianCube(Musician.objects.all()), []
+    >>> racing_threads = [threading.Thread(target=lambda: bound.append(racing_c._bound_dimension('firstname'))) for i in range(8)]
+    >>> for thread in racing_threads: thread.start()
+    >>> for thread in racing_threads: thread.join()
+    >>> len(bound), set([dimension.field for dimension in bound])
+    (8, set(['firstname']))
+    >>> copy.copy(racing_c)._dimensions is racing_c._dimensions, racing_c.constrain(firstname='Bill')._dimensions
+    (False, None)
+
+    ----- No query to build, copy or constrain a cube
+    >>> from django.conf import settings
+    >>> from django.db import connection
+    >>> settings.DEBUG, queries_before = True, len(connection.queries)
+    >>> evaluated_qs = Song.objects.all()
+    >>> evaluated_qs = evaluated_qs if len(evaluated_qs) else None
+    >>> queries_before = len(connection.queries)
+    >>> class SongDimensionsCube(MusicianCube):
+    ...     song = Dimension(field='song', queryset=evaluated_qs)
+    >>> class SubSongDimensionsCube(SongDimensionsCube):
+    ...     pass
+    >>> song_d = SubSongDimensionsCube._meta.dimensions['song']
+    >>> song_d.queryset is evaluated_qs, song_d.queryset._result_cache, copy.deepcopy(song_d).queryset._result_cache
+    (False, None, None)
+    >>> quiet_c = SubSongDimensionsCube(Musician.objects.all()).constrain(firstname='Miles', lastname='Davis')
+    >>> quiet_c.dimensions['firstname'].get_sample_space(), quiet_c.dimensions['song'].constraint
+    (['Miles'], None)
+    >>> quiet_c == copy.deepcopy(quiet_c), hash(quiet_c) == hash(copy.copy(quiet_c))
+    (True, True)
+    >>> len(connection.queries) - queries_before
+    0
+    >>> len(list(quiet_c.constrain(firstname=None).dimensions['firstname'].get_sample_space())) > 1, len(connection.queries) - queries_before
+    (True, 1)
+    >>> settings.DEBUG = False
+
+    ----- Hashable cubes
+    >>> subcube.constraint_key
+    (('firstname', 'Miles'), ('lastname', 'Davis'))
+    >>> subcube == MusicianCube(Musician.objects.all()).constrain(lastname='Davis', firstname='Miles')
+    True
+    >>> subcube == c.constrain(firstname='Miles') ; subcube == c.constrain(firstname='Miles', lastname='Davis', instrument=None)
+    False
+    True
+    >>> subcube == MusicianCube(Musician.objects.filter(firstname='Miles')).constrain(firstname='Miles', lastname='Davis')
+    False
+    >>> c == MusicianCube(Musician.objects.none()) ; c == MusicianCube(Musician.objects.all(), measure_none=None)
+    False
+    False
+    >>> memo = {subcube: 1}
+    >>> memo[c.constrain(firstname='Miles').constrain(lastname='Davis')]
+    1
+
+    ----- Pickling cubes and results. The cube class must be importable from its module.
+    >>> import sys, cPickle as pickle
+    >>> from django.db import connection
+    >>> from django.conf import settings
+    >>> setattr(sys.modules[MusicianCube.__module__], 'MusicianCube', MusicianCube)
+    >>> settings.DEBUG, queries_before = True, len(connection.queries)
+    >>> for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+    ...     unpickled = pickle.loads(pickle.dumps(subcube, protocol))
+    ...     print unpickled == subcube, unpickled._constraint == subcube._constraint, unpickled.queryset._result_cache
+    True True None
+    True True None
+    True True None
+    >>> len(connection.queries) - queries_before
+    0
+    >>> settings.DEBUG = False
+    >>> unpickled.measure() == subcube.measure()
+    True
+    >>> unpickled.constrain(firstname=None) == c.constrain(lastname='Davis')
+    True
+    >>> class WorkingCube(MusicianCube):
+    ...     __slots__ = ('job',)
+    >>> setattr(sys.modules[MusicianCube.__module__], 'WorkingCube', WorkingCube)
+    >>> working_c = WorkingCube(Musician.objects.all(), workers=2).constrain(instrument_name='piano')
+    >>> working_c.job = 'report'
+    >>> unpickled = pickle.loads(pickle.dumps(working_c, pickle.HIGHEST_PROTOCOL))
+    >>> unpickled == working_c, unpickled.job, unpickled.workers
+    (True, 'report', 2)
+    >>> copy.copy(working_c).job, copy.copy(working_c)._fingerprint_cache is working_c._fingerprint_cache
+    ('report', True)
+    >>> class TitledCube(MusicianCube):
+    ...     def __init__(self, queryset, title):
+    ...         super(TitledCube, self).__init__(queryset)
+    ...         self.title = title
+    >>> setattr(sys.modules[MusicianCube.__module__], 'TitledCube', TitledCube)
+    >>> titled_c = TitledCube(Musician.objects.all(), 'Musicians').constrain(firstname='Miles')
+    >>> copy.copy(titled_c).title, pickle.loads(pickle.dumps(titled_c, pickle.HIGHEST_PROTOCOL)).title
+    ('Musicians', 'Musicians')
+    >>> pickle.loads(pickle.dumps(c.measures_dict('firstname', 'instrument_name'), pickle.HIGHEST_PROTOCOL)) == c.measures_dict('firstname', 'instrument_name')
+    True
+    >>> sparse = c.measures_sparse('firstname', 'instrument_name')
+    >>> unpickled = pickle.loads(pickle.dumps(sparse, pickle.HIGHEST_PROTOCOL))
+    >>> unpickled.to_measures_dict() == sparse.to_measures_dict(), unpickled.measure(firstname='Miles', instrument_name='trumpet')
+    (True, 1)
+    >>> len(pickle.dumps(unpickled, pickle.HIGHEST_PROTOCOL)) == len(pickle.dumps(sparse, pickle.HIGHEST_PROTOCOL))
+    True
+
 Get a cube's sample space
 ----------------------------
 
@@ -312,6 +531,57 @@ Once you have instantiated a cube with a base queryset, you can access a measure
     >>> c.measure()
     6
 
+Memoizing measures during a request
+-------------------------------------
+
+A page often asks several times for the same measure. With the middleware :class:`memo.MemoMiddleware`, or inside the context manager :func:`memo.measures_memo`, the measures and the sample spaces are calculated only once for equal cubes :
+
+    >>> from cube.memo import measures_memo
+    >>> calculated = []
+    >>> class CountingCube(MusicianCube):
+    ...     @staticmethod
+    ...     def aggregation(queryset):
+    ...         calculated.append(queryset)
+    ...         return queryset.count()
+    >>> c = CountingCube(Musician.objects.all())
+    >>> with measures_memo():
+    ...     c.measure(firstname='Bill') + c.constrain(firstname='Bill').measure()
+    4
+    >>> len(calculated)
+    1
+
+Outside of the memo, the measures are always calculated again :
+
+    >>> c.measure(firstname='Bill')
+    2
+    >>> len(calculated)
+    2
+
+..
+    ----- nested memos, and the middleware
+    >>> from cube.memo import get_memo, MemoMiddleware
+    >>> from django.http import HttpRequest, HttpResponse
+    >>> with measures_memo() as memo:
+    ...     with measures_memo() as nested_memo:
+    ...         nested_memo is memo
+    ...     get_memo() is memo
+    True
+    True
+    >>> get_memo() is None
+    True
+    >>> middleware = MemoMiddleware()
+    >>> middleware.process_request(HttpRequest())
+    >>> c.measure() ; c.measure() ; len(calculated)
+    6
+    6
+    3
+    >>> get_memo()[('measure', CountingCube(Musician.objects.all()))]
+    6
+    >>> middleware.process_response(HttpRequest(), HttpResponse()) is not None
+    True
+    >>> get_memo() is None
+    True
+
 Iterating over cube's subcubes
 ---------------------------------
 
@@ -363,6 +633,240 @@ Using :meth:`Cube.measures`, you can get a list of measures, very similar to wha
     ... ]
     True
 
+Iterating over measures
+-------------------------
+
+:meth:`Cube.measures_iter` returns the same measures as :meth:`Cube.measures`, but calculates them lazily, by batches of subcubes :
+
+    >>> list(c.measures_iter('firstname', 'instrument_name', batch_size=3)) == c.measures('firstname', 'instrument_name')
+    True
+
+If the cube declares a Django aggregate *aggregate*, all the measures of a batch are calculated with one grouped query :
+
+    >>> class GroupedMusicianCube(MusicianCube):
+    ...     aggregate = Count('pk')
+    >>> grouped_c = GroupedMusicianCube(Musician.objects.filter(instrument__name__in=['piano', 'trumpet']))
+    >>> list(grouped_c.measures_iter('firstname', 'instrument_name', batch_size=3)) == c.measures('firstname', 'instrument_name')
+    True
+    >>> list(grouped_c.measures_iter('instrument', 'lastname')) == c.measures('instrument', 'lastname')
+    True
+
+A false value (None, 0, '', ...) in a sample space doesn't constrain its dimension, with or without a grouped query :
+
+    >>> class NullFirstnameCube(MusicianCube):
+    ...     firstname = Dimension(sample_space=['Miles', 'Bill', None])
+    >>> class GroupedNullFirstnameCube(NullFirstnameCube):
+    ...     aggregate = Count('pk')
+    >>> null_c = NullFirstnameCube(Musician.objects.all())
+    >>> grouped_null_c = GroupedNullFirstnameCube(Musician.objects.all())
+    >>> [measure['__measure'] for measure in grouped_null_c.measures('firstname')]
+    [1, 2, 6]
+    >>> grouped_null_c.measures_list('firstname') == null_c.measures_list('firstname') == [1, 2, 6]
+    True
+    >>> grouped_null_c.measures_list('firstname', 'instrument_name') == null_c.measures_list('firstname', 'instrument_name')
+    True
+    >>> grouped_null_c.measures('firstname', 'instrument_name') == null_c.measures('firstname', 'instrument_name')
+    True
+
+..
+    ----- the *__in* filters of the grouped queries stay within the parameter limits of the database
+    >>> import cube.models
+    >>> max_params, cube.models.GROUPED_FILTER_MAX_PARAMS = cube.models.GROUPED_FILTER_MAX_PARAMS, 2
+    >>> all_grouped_c = GroupedMusicianCube(Musician.objects.all())
+    >>> filters_sizes = []
+    >>> grouped_measures = GroupedMusicianCube._grouped_measures
+    >>> def recording_grouped_measures(self, dim_names, filters_dict={}):
+    ...     filters_sizes.append(sum([len(values) for values in filters_dict.values()]))
+    ...     return grouped_measures(self, dim_names, filters_dict)
+    >>> GroupedMusicianCube._grouped_measures = recording_grouped_measures
+    >>> all_grouped_c.table_helper('firstname', 'instrument_name') == MusicianCube(Musician.objects.all()).table_helper('firstname', 'instrument_name')
+    True
+    >>> list(all_grouped_c.measures_iter('instrument', 'lastname')) == MusicianCube(Musician.objects.all()).measures('instrument', 'lastname')
+    True
+    >>> len(filters_sizes) > 0, max(filters_sizes) <= 2
+    (True, True)
+    >>> del GroupedMusicianCube._grouped_measures ; cube.models.GROUPED_FILTER_MAX_PARAMS = max_params
+
+Dimensions that use a field-lookup cannot be grouped, so their measures are calculated one by one :
+
+    >>> list(grouped_c.measures_iter('instrument_cat', 'firstname')) == c.measures('instrument_cat', 'firstname')
+    True
+
+The sample space of the first dimension is streamed from the database, so that the subcubes of a dimension with many values are never all in memory :
+
+    >>> streamed = c.dimensions['firstname'].iter_sample_space()
+    >>> streamed.next(), streamed.next()
+    (u'Bill', u'Erroll')
+
+..
+    ----- streamed sample spaces
+    >>> import types
+    >>> from django.conf import settings
+    >>> from django.db import connection
+    >>> isinstance(c.dimensions['firstname'].iter_sample_space(), types.GeneratorType)
+    True
+    >>> list(c.dimensions['firstname'].iter_sample_space()) == c.get_sample_space('firstname', format='flat')
+    True
+    >>> list(c.constrain(firstname='Miles').dimensions['firstname'].iter_sample_space())
+    ['Miles']
+    >>> [subcube.constraint for subcube in c.subcubes('firstname', 'instrument_name')] == c.get_sample_space('firstname', 'instrument_name')
+    True
+    >>> settings.DEBUG, queries_before = True, len(connection.queries)
+    >>> subcubes = c.subcubes('instrument', 'lastname')
+    >>> subcubes.next() == c.constrain(instrument=trumpet, lastname='Davis'), len(connection.queries) - queries_before
+    (True, 2)
+    >>> settings.DEBUG = False
+    >>> class ReversedCube(MusicianCube):
+    ...     @staticmethod
+    ...     def sort_key(coordinates):
+    ...         return coordinates['firstname'][::-1]
+    >>> [subcube.constraint['firstname'] for subcube in ReversedCube(c.queryset).subcubes('firstname')]
+    [u'Freddie', u'Bill', u'Erroll', u'Miles', u'Thelonious']
+    >>> from cube.memo import measures_memo
+    >>> with measures_memo():
+    ...     list(c.subcubes('firstname')) == list(c.subcubes('firstname'))
+    True
+
+Measures that cannot be grouped can be calculated concurrently by several threads, each with its own database connection, by giving the number of threads to the cube : ::
+
+    >>> c = MusicianCube(Musician.objects.all(), workers=4)
+
+The measures are returned in the same order as when they are calculated one by one.
+
+..
+    ----- measures calculated by several threads. The aggregation doesn't access the database, because the test database only exists for the main thread.
+    >>> import threading, time
+    >>> threads = set()
+    >>> class ThreadedCube(MusicianCube):
+    ...     @staticmethod
+    ...     def aggregation(queryset):
+    ...         threads.add(threading.current_thread().name)
+    ...         time.sleep(0.005)
+    ...         return len(str(queryset.query))
+    >>> serial_measures = ThreadedCube(Musician.objects.all()).measures('firstname', 'instrument_cat')
+    >>> threads.clear()
+    >>> threaded_c = ThreadedCube(Musician.objects.all(), workers=4)
+    >>> threaded_c.measures('firstname', 'instrument_cat') == serial_measures
+    True
+    >>> len(threads) > 1, threading.current_thread().name in threads
+    (True, False)
+    >>> threaded_c.table_helper('instrument_cat', 'firstname') == ThreadedCube(Musician.objects.all()).table_helper('instrument_cat', 'firstname')
+    True
+    >>> threads.clear() ; thread_count = threading.active_count()
+    >>> list(threaded_c.measures_iter('firstname', 'instrument_cat', batch_size=2)) == serial_measures
+    True
+    >>> len(threads) <= 4, threading.active_count() == thread_count
+    (True, True)
+    >>> threads.clear()
+    >>> threaded_c.table_helper('instrument_cat', 'firstname') == ThreadedCube(Musician.objects.all()).table_helper('instrument_cat', 'firstname')
+    True
+    >>> len(threads - set([threading.current_thread().name])) <= 4, threading.active_count() == thread_count
+    (True, True)
+    >>> class FailingCube(MusicianCube):
+    ...     @staticmethod
+    ...     def aggregation(queryset):
+    ...         raise ZeroDivisionError('in a thread')
+    >>> FailingCube(Musician.objects.all(), workers=2).measures('instrument_cat')
+    Traceback (most recent call last):
+    ...
+    ZeroDivisionError: in a thread
+
+Calculations can also be started in the background : :meth:`Cube.ameasure`, :meth:`Cube.ameasures` and :meth:`Cube.atable_helper` return a :class:`cube.parallel.Future`, whose result is waited for with :meth:`cube.parallel.Future.result` : ::
+
+    from cube.parallel import gather
+    futures = [cube.atable_helper('dim1', 'dim2') for cube in cubes]
+    contexts = gather(futures)
+
+..
+    ----- futures
+    >>> from cube.parallel import gather, submit, FutureTimeout
+    >>> class FutureCube(ThreadedCube):
+    ...     firstname = Dimension(sample_space=['Miles', 'Bill'])
+    >>> c1 = FutureCube(Musician.objects.all())
+    >>> c2 = FutureCube(Musician.objects.filter(firstname='Miles'))
+    >>> threads.clear()
+    >>> futures = [c1.ameasure(instrument_cat=('trumpet', 'piano')), c1.ameasures('instrument_cat'), c2.atable_helper('instrument_cat', 'firstname')]
+    >>> gather(futures) == [c1.measure(instrument_cat=('trumpet', 'piano')), c1.measures('instrument_cat'), c2.table_helper('instrument_cat', 'firstname')]
+    True
+    >>> [future.done() for future in futures]
+    [True, True, True]
+    >>> len(threads), threading.current_thread().name in threads
+    (4, True)
+    >>> c1.ameasures('instrument_cat').result(timeout=5) == c1.measures('instrument_cat')
+    True
+    >>> FailingCube(Musician.objects.all()).ameasure(instrument_cat=('trumpet', 'piano')).result()
+    Traceback (most recent call last):
+    ...
+    ZeroDivisionError: in a thread
+    >>> event = threading.Event()
+    >>> submit(event.wait).result(timeout=0.01)
+    Traceback (most recent call last):
+    ...
+    FutureTimeout: the calculation is not finished after 0.01 seconds
+    >>> event.set()
+
+Precalculating measures by partitions
+---------------------------------------
+
+For very big cubes, :func:`cube.parallel.precompute` splits the calculation by the values of one dimension, and can give each partition to a pool of worker processes. Each partition can also be saved in a directory, so that a job that was interrupted is resumed from the partitions already saved : ::
+
+    from cube.parallel import precompute
+    sparse = precompute(cube, 'firstname', 'instrument_name', processes=4, checkpoint_dir='/var/tmp/cube')
+
+The cube is pickled to be sent to the worker processes, so its class must be importable from its module.
+
+The result is a :class:`cube.query.SparseMeasures`, that holds all the measures of the cube for these dimensions.
+
+..
+    ----- partitions calculated in the current process, with checkpoints
+    >>> import tempfile, shutil, os
+    >>> from cube.parallel import precompute
+    >>> c = MusicianCube(Musician.objects.filter(instrument__name__in=['piano', 'trumpet']))
+    >>> checkpoint_dir = tempfile.mkdtemp()
+    >>> sparse = precompute(c, 'firstname', 'instrument_name', checkpoint_dir=checkpoint_dir)
+    >>> sparse.to_measures_dict() == c.measures_dict('firstname', 'instrument_name', full=False)
+    True
+    >>> sparse.to_measures_list() == c.measures_list('firstname', 'instrument_name')
+    True
+    >>> len(os.listdir(checkpoint_dir)) == len(c.get_sample_space('firstname'))
+    True
+    >>> calls = []
+    >>> class CountingCube(MusicianCube):
+    ...     @staticmethod
+    ...     def aggregation(queryset):
+    ...         calls.append(1)
+    ...         return queryset.count()
+    >>> counting_c = CountingCube(c.queryset)
+    >>> shutil.rmtree(checkpoint_dir); checkpoint_dir = tempfile.mkdtemp()
+    >>> precompute(counting_c, 'firstname', 'instrument_name', checkpoint_dir=checkpoint_dir).to_measures_dict() == c.measures_dict('firstname', 'instrument_name', full=False)
+    True
+    >>> len(calls) == len(c.get_sample_space('firstname')) * len(c.get_sample_space('instrument_name'))
+    True
+    >>> del calls[:]
+    >>> os.remove(os.path.join(checkpoint_dir, os.listdir(checkpoint_dir)[0]))
+    >>> precompute(counting_c, 'firstname', 'instrument_name', checkpoint_dir=checkpoint_dir).to_measures_dict() == c.measures_dict('firstname', 'instrument_name', full=False)
+    True
+    >>> len(calls) == len(c.get_sample_space('instrument_name'))
+    True
+    >>> art_farmer = Musician(firstname='Art', lastname='Farmer', instrument=trumpet)
+    >>> art_farmer.save()
+    >>> del calls[:]
+    >>> precompute(counting_c, 'firstname', 'instrument_name', checkpoint_dir=checkpoint_dir).to_measures_list() == c.measures_list('firstname', 'instrument_name')
+    True
+    >>> len(calls) == len(c.get_sample_space('instrument_name'))
+    True
+    >>> c_all = CountingCube(Musician.objects.all())
+    >>> precompute(c_all, 'firstname', 'instrument_name', checkpoint_dir=checkpoint_dir).to_measures_list() == c_all.measures_list('firstname', 'instrument_name')
+    True
+    >>> drums = Instrument(name='drums')
+    >>> drums.save()
+    >>> art_farmer.instrument = drums
+    >>> art_farmer.save()
+    >>> precompute(c_all, 'firstname', 'instrument_name', checkpoint_dir=checkpoint_dir).to_measures_list() == c_all.measures_list('firstname', 'instrument_name')
+    True
+    >>> art_farmer.delete(); drums.delete()
+    >>> shutil.rmtree(checkpoint_dir)
+
 Multidimensionnal dictionnary of measures
 -------------------------------------------
 
@@ -437,6 +941,46 @@ You can do the same thing, but calculating only the measures for the subcubes wh
     ... }
     True
 
+The measures can also be returned in a flat dictionnary, whose keys are tuples of dimensions' values. In these keys, :data:`query.ROLLUP` stands for a dimension that is not fixed :
+
+    >>> from cube.query import ROLLUP
+    >>> flat_dict = c.measures_dict('firstname', 'instrument_name', format='flat')
+    >>> flat_dict[(ROLLUP, ROLLUP)], flat_dict[('Bill', ROLLUP)], flat_dict[('Bill', 'piano')], flat_dict[('Bill', 'trumpet')]
+    (5, 1, 1, 0)
+    >>> len(flat_dict)
+    16
+
+With *full=False*, only the measures with all the dimensions fixed are returned :
+
+    >>> c.measures_dict('firstname', 'instrument_name', format='flat', full=False) == {
+    ...     ('Bill', 'piano'): 1, ('Bill', 'trumpet'): 0,
+    ...     ('Erroll', 'piano'): 1, ('Erroll', 'trumpet'): 0,
+    ...     ('Freddie', 'piano'): 0, ('Freddie', 'trumpet'): 1,
+    ...     ('Miles', 'piano'): 0, ('Miles', 'trumpet'): 1,
+    ...     ('Thelonious', 'piano'): 1, ('Thelonious', 'trumpet'): 0,
+    ... }
+    True
+
+..
+    >>> def flatten(nested_dict, values=()):
+    ...     flat_dict = {}
+    ...     flat_dict[values + (ROLLUP,) * (2 - len(values))] = nested_dict['measure']
+    ...     for value, sub_dict in nested_dict.get('subcubes', {}).items():
+    ...         flat_dict.update(flatten(sub_dict, values + (value,)))
+    ...     return flat_dict
+    >>> flat_dict == flatten(c.measures_dict('firstname', 'instrument_name'))
+    True
+    >>> keys = flat_dict.keys()
+    >>> keys[0] == (ROLLUP, ROLLUP) and keys[1][1] == ROLLUP and keys[2][:1] == keys[3][:1] == keys[1][:1]
+    True
+    >>> grouped_c = GroupedMusicianCube(c.queryset)
+    >>> grouped_c.measures_dict('instrument', 'lastname', format='flat') == flatten(c.measures_dict('instrument', 'lastname'))
+    True
+    >>> grouped_c.measures_dict('instrument', format='xml')
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid format 'xml'
+
 Multidimensionnal list of measures
 ------------------------------------
 
@@ -458,6 +1002,78 @@ Using :meth:`Cube.measures_list`, you can get a list of measures organized by di
     ... ]
     True
 
+Multidimensionnal array of measures
+-------------------------------------
+
+If `numpy` is installed, :meth:`Cube.measures_array` returns the measures as a `numpy` array, with the list of labels for each dimension of the array. The labels are in the same order as in :meth:`Cube.measures_list` : ::
+
+    array, axes = c.measures_array('firstname', 'instrument_name', dtype=int)
+    array.tolist() == c.measures_list('firstname', 'instrument_name') # True
+    axes[1] == ['piano', 'trumpet'] # True
+
+..
+    >>> try:
+    ...     import numpy
+    ... except ImportError:
+    ...     numpy = None
+    >>> if numpy:
+    ...     array, axes = c.measures_array('firstname', 'instrument_name', dtype=int)
+    ...     array.tolist() == c.measures_list('firstname', 'instrument_name')
+    ...     axes == [
+    ...         [subcube.constraint['firstname'] for subcube in c.subcubes('firstname')],
+    ...         [subcube.constraint['instrument_name'] for subcube in c.subcubes('instrument_name')],
+    ...     ]
+    ...     array, axes = GroupedMusicianCube(c.queryset).measures_array('firstname', 'instrument', dtype=int)
+    ...     array.tolist() == c.measures_list('firstname', 'instrument')
+    ... else:
+    ...     True ; True ; True
+    True
+    True
+    True
+    >>> c.measures_array('firstname', dtyp=int)
+    Traceback (most recent call last):
+    ...
+    TypeError: measures_array() got an unexpected keyword argument 'dtyp'
+
+Sparse measures
+-----------------
+
+For cubes where most of the measures are empty, :meth:`Cube.measures_sparse` stores only the measures that are not *measure_none*, as parallel arrays of coordinates and an array of measures :
+
+    >>> sparse = c.measures_sparse('firstname', 'instrument_name')
+    >>> len(sparse)
+    5
+    >>> sparse.measure(firstname='Bill', instrument_name='piano'), sparse.measure(firstname='Bill', instrument_name='trumpet')
+    (1, 0)
+
+Iterating over it gives the stored measures, in the order of the dimensions' sample spaces :
+
+    >>> list(sparse) == [
+    ...     ((subcube.constraint['firstname'], subcube.constraint['instrument_name']), subcube.measure())
+    ...     for subcube in c.subcubes('firstname', 'instrument_name') if subcube.measure()
+    ... ]
+    True
+
+And it can be converted to the structures of :meth:`Cube.measures_list` and :meth:`Cube.measures_dict` :
+
+    >>> sparse.to_measures_list() == c.measures_list('firstname', 'instrument_name')
+    True
+    >>> sparse.to_measures_dict() == c.measures_dict('firstname', 'instrument_name', full=False)
+    True
+
+..
+    >>> sparse = GroupedMusicianCube(c.queryset).measures_sparse('instrument', 'firstname', 'lastname')
+    >>> sparse.to_measures_list() == c.measures_list('instrument', 'firstname', 'lastname')
+    True
+    >>> sparse.to_measures_dict() == c.measures_dict('instrument', 'firstname', 'lastname', full=False)
+    True
+    >>> sparse.measure(firstname='Bill', instrument=piano, lastname='Monk')
+    0
+    >>> sparse.measure(firstname='John', instrument=piano, lastname='Monk')
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid coordinates ...
+
 Getting a subcube
 ------------------
 
@@ -658,6 +1274,20 @@ Here is what the rendering gives :
     >>> awaited == template.render(context)
     True
 
+The measures of the subcubes are only calculated when they are displayed, and all the measures of one nesting level are calculated together. So if the cube declares an *aggregate*, there is only one grouped query for each nesting level of the template :
+
+    >>> from django.conf import settings
+    >>> from django.db import connection, reset_queries
+    >>> settings.DEBUG = True ; reset_queries()
+    >>> rendered = template.render(Context({'my_cube': GroupedMusicianCube(c.queryset), 'dim1': 'firstname'}))
+    >>> sorted(rendered.split('Cube(')) == sorted(template.render(context).split('Cube('))
+    True
+    >>> len([query for query in connection.queries if 'GROUP BY' in query['sql']])
+    2
+
+..
+    >>> settings.DEBUG = False
+
 
 Get a pretty display of a dimension's constraint
 ----------------------------------------------------
@@ -677,6 +1307,33 @@ In your templates, you can access the pretty value of dimension's constraint by
     u'>FUNKY<Sax>FUNKY<'
 
 ..
+    ----- The labels of an axis are resolved together
+    >>> label_calls = []
+    >>> class CountingInstrumentIdDimension(InstrumentIdDimension):
+    ...     def pretty_constraints(self, values):
+    ...         label_calls.append(len(values))
+    ...         return super(CountingInstrumentIdDimension, self).pretty_constraints(values)
+    >>> class InstrumentIdCube(MusicianCube):
+    ...     instrument_id = CountingInstrumentIdDimension(field='instrument__id')
+    >>> c = InstrumentIdCube(Musician.objects.all())
+    >>> context = c.table_helper('instrument_id', 'lastname', totals=False)
+    >>> sorted([label for value, label in context['col_names']]), label_calls
+    ([u'Piano', u'Sax', u'Trumpet'], [3])
+    >>> del label_calls[:]
+    >>> template = Template(
+    ... '{% load cube_templatetags %}'
+    ... '{% subcubes cube by "lastname" as l_subcube %}{% subcubes l_subcube by "instrument_id" as i_subcube %}'
+    ... '{{ i_subcube|prettyconstraint:"instrument_id" }} '
+    ... '{% endsubcubes %}{% endsubcubes %}'
+    ... )
+    >>> labels = template.render(Context({'cube': c})).split()
+    >>> sorted(set(labels)), len(labels) == 3 * len(c.get_sample_space('lastname', format='flat')), label_calls == [len(labels)]
+    ([u'Piano', u'Sax', u'Trumpet'], True, True)
+    >>> instrument_ids = c.get_sample_space('instrument_id', format='flat')
+    >>> c.dimensions['instrument_id'].pretty_constraints(instrument_ids) == [Instrument.objects.get(pk=pk).name.capitalize() for pk in instrument_ids]
+    True
+    >>> c.constrain(instrument_id=sax.pk).dimensions['instrument_id'].pretty_constraint
+    u'Sax'
 
     ----- Test creation of table from cube context
     >>> c = MusicianCube(Musician.objects.all())
@@ -711,6 +1368,38 @@ In your templates, you can access the pretty value of dimension's constraint by
     ...     'col_dim_name': 'firstname',
     ...     'row_dim_name': 'instrument',
     ...     'overall': 6,
+    ...     'col_offset': 0,
+    ...     'row_offset': 0,
+    ...     'col_count': 5,
+    ...     'row_count': 3,
+    ... }
+    True
+
+Paginate a table
+-----------------
+
+For big tables, you can calculate only a window of the table, by giving offsets and limits for the columns and the rows. Only the cells inside this window are calculated :
+
+    >>> full_table = c.table_helper('firstname', 'instrument')
+    >>> table = c.table_helper('firstname', 'instrument', col_offset=1, col_limit=2, row_limit=2)
+    >>> table['col_names'] == full_table['col_names'][1:3]
+    True
+    >>> table['row_names'] == full_table['row_names'][:2]
+    True
+    >>> [row['values'] for row in table['rows']] == [row['values'][1:3] for row in full_table['rows'][:2]]
+    True
+    >>> table['col_offset'], table['col_count'], table['row_offset'], table['row_count']
+    (1, 5, 0, 3)
+
+The overalls can be calculated separately, with :meth:`Cube.table_totals` :
+
+    >>> table = c.table_helper('firstname', 'instrument', col_offset=1, col_limit=2, totals=False)
+    >>> table['overall'], table['col_overalls'], table['cols'][0]['overall']
+    (None, [None, None], None)
+    >>> c.table_totals('firstname', 'instrument', col_offset=1, col_limit=2) == {
+    ...     'col_overalls': full_table['col_overalls'][1:3],
+    ...     'row_overalls': full_table['row_overalls'],
+    ...     'overall': 6,
     ... }
     True
 
@@ -793,6 +1482,102 @@ Here is what the rendering gives :
     >>> awaited == re.sub(' |\\n', '', template.render(context))
     True
 
+    ----- literal arguments are resolved when parsing, the template is loaded only once, and the context is left unchanged
+    >>> node = template.nodelist[-1]
+    >>> node.dimensions[1], node._templates.keys()
+    ('instrument_name', ['table_from_cube.html'])
+    >>> dicts_count = len(context.dicts)
+    >>> template.render(context) == template.render(context)
+    True
+    >>> len(context.dicts) == dicts_count, 'cols' in context
+    (True, False)
+    >>> template = Template(
+    ...     '{% load cube_templatetags %}'
+    ...     '{% subcubes my_cube by "instrument_cat" as subcube %}{{ subcube.measure }}{% endsubcubes %}'
+    ...     '{{ subcube }}'
+    ... )
+    >>> template.nodelist[-2]
+    <Subcube Node: my_cube by instrument_cat as subcube>
+    >>> template.render(context)
+    u'534'
+
+Caching a table
+-----------------
+
+A rendered table can be cached, by adding *cache <timeout>* to the tag. The table is then served from the cache until the timeout expires, or until an instance of one of the models of the cube is saved or deleted :
+
+    >>> template = Template(
+    ... '{% load cube_templatetags %}'
+    ... '{% tablefromcube my_cube by dim1, "instrument_name" using template_name cache 600 %}'
+    ... )
+    >>> settings.DEBUG = True ; reset_queries()
+    >>> table = template.render(context)
+    >>> len(connection.queries) > 0
+    True
+    >>> reset_queries()
+    >>> template.render(context) == table ; len(connection.queries)
+    True
+    0
+    >>> trumpet.save() ; reset_queries()
+    >>> template.render(context) == table ; len(connection.queries) > 0
+    True
+    True
+
+If the template uses other variables of the context, they are given after the timeout, and a table is cached for each of their values :
+
+    >>> template = Template(
+    ... '{% load cube_templatetags %}'
+    ... '{% tablefromcube my_cube by dim1, "instrument_name" using template_name cache 600 user_name %}'
+    ... )
+    >>> context['user_name'] = 'miles'
+    >>> table = template.render(context) ; reset_queries()
+    >>> template.render(context) == table ; len(connection.queries)
+    True
+    0
+    >>> context['user_name'] = 'bill'
+    >>> template.render(context) == table ; len(connection.queries) > 0
+    True
+    True
+
+..
+    >>> settings.DEBUG = False
+    >>> from cube.cache import fragment_key
+    >>> key = fragment_key(c, ['firstname', 'instrument_name'], 'table_from_cube.html')
+    >>> key == fragment_key(MusicianCube(Musician.objects.all()), ['firstname', 'instrument_name'], 'table_from_cube.html')
+    True
+    >>> key == fragment_key(c.constrain(instrument=trumpet), ['firstname', 'instrument_name'], 'table_from_cube.html')
+    False
+    >>> key == fragment_key(c, ['firstname', 'instrument_name'], 'other_table.html')
+    False
+    >>> guitar = Instrument(name='guitar') ; guitar.save()
+    >>> key = fragment_key(c, ['firstname', 'instrument_name'], 'table_from_cube.html')
+    >>> guitar.delete() ; key == fragment_key(c, ['firstname', 'instrument_name'], 'table_from_cube.html')
+    False
+    >>> from django.core.cache import cache
+    >>> from cube.cache import table_etag, _version_key
+    >>> cache.delete(_version_key(Instrument)) ; etag = table_etag(c, ['firstname', 'instrument_name'], 'table_from_cube.html')
+    >>> guitar.save() ; cache.delete(_version_key(Instrument))
+    >>> table_etag(c, ['firstname', 'instrument_name'], 'table_from_cube.html') == etag
+    False
+    >>> guitar.delete()
+
+The data versions are bumped in a process that never rendered a table, once the cube is registered with :func:`cache.watch_cube` :
+
+    >>> from django.db.models import signals
+    >>> from cube.cache import get_data_version, watch_cube, _version_key
+    >>> for signal in (signals.post_save, signals.post_delete):
+    ...     signal.disconnect(sender=Song, dispatch_uid=_version_key(Song))
+    >>> class SongTitleCube(Cube):
+    ...     title = Dimension()
+    >>> song_c = SongTitleCube(Song.objects.all())
+    >>> version = get_data_version(Song)
+    >>> so_what.save() ; get_data_version(Song) == version
+    True
+    >>> watch_cube(song_c)
+    >>> version = get_data_version(Song)
+    >>> so_what.save() ; get_data_version(Song) == version
+    False
+
 Views
 =======
 
@@ -805,6 +1590,7 @@ Let's create a cube
 
 ..
     >>> from django.http import HttpRequest
+    >>> from django.utils import simplejson
     >>> request = HttpRequest()
 
 Let's use the view :func:`views.table_from_cube` which will render the template with a context built from :meth:`models.Cube.table_helper`. :
@@ -873,6 +1659,153 @@ Here is what the rendering gives :
     >>> awaited == re.sub(' |\\n|<BLANKLINE>', '', str(response))
     True
 
+Export measures
+-----------------
+
+The view :func:`views.measures_export` streams the measures of a cube as a CSV file :
+
+    >>> c = MusicianCube(Musician.objects.filter(firstname='Bill'))
+    >>> response = measures_export(HttpRequest(), cube=c, dimensions=['lastname', 'instrument_name'])
+    >>> response['Content-Type']
+    'text/csv'
+    >>> response.content.splitlines()
+    ['lastname,instrument_name,measure', 'Evans,piano,1', 'Evans,sax,1']
+
+or as a NDJSON file, with one JSON object per line :
+
+    >>> response = measures_export(HttpRequest(), cube=c, dimensions=['instrument'], format='ndjson')
+    >>> [simplejson.loads(line) for line in response.content.splitlines()] == [
+    ...     {'instrument': piano.pk, 'measure': 1},
+    ...     {'instrument': sax.pk, 'measure': 1},
+    ... ]
+    True
+
+..
+    >>> request = HttpRequest()
+    >>> request.GET = {'format': 'xml'}
+    >>> response = measures_export(request, cube=c, dimensions=['instrument'])
+    >>> response.status_code, response.content
+    (400, "invalid export format 'xml'")
+    >>> from django.db import connections
+    >>> closed = []
+    >>> def close_hook(self, close=type(connection).close):
+    ...     closed.append(self.alias)
+    ...     close(self)
+    >>> type(connection).close = close_hook
+    >>> response = measures_export(HttpRequest(), cube=c, dimensions=['instrument'])
+    >>> lines = list(response) ; closed == [conn.alias for conn in connections.all()]
+    True
+    >>> type(connection).close = close_hook.func_defaults[0]
+
+Measures as JSON
+------------------
+
+The view :func:`views.measures_json` returns the measures of a cube as JSON, with the labels of the axes and the totals, for rendering the cube client-side :
+
+    >>> response = measures_json(HttpRequest(), cube=c, dimensions=['lastname', 'instrument'])
+    >>> response['Content-Type']
+    'application/json'
+    >>> simplejson.loads(response.content) == {
+    ...     'dimensions': ['lastname', 'instrument'],
+    ...     'axes': [
+    ...         {'values': ['Evans'], 'labels': ['Evans'], 'offset': 0, 'count': 1},
+    ...         {'values': [piano.pk, sax.pk], 'labels': ['Piano', 'Sax'], 'offset': 0, 'count': 2},
+    ...     ],
+    ...     'measure_none': 0,
+    ...     'cells': [[1, 1]],
+    ...     'totals': {'axes': [[2], [1, 1]], 'overall': 2},
+    ... }
+    True
+
+With the format 'sparse', only the cells that are not empty are sent, as arrays of indexes in the axes. A page of each axis can be requested with the GET parameters *offsets* and *limits* :
+
+    >>> request = HttpRequest()
+    >>> request.GET = {'format': 'sparse', 'offsets': '0,1', 'limits': ',1', 'totals': '0'}
+    >>> data = simplejson.loads(measures_json(request, cube=c, dimensions=['lastname', 'instrument']).content)
+    >>> data['axes'][1] == {'values': [sax.pk], 'labels': ['Sax'], 'offset': 1, 'count': 2}
+    True
+    >>> data['cells'], 'totals' in data
+    ({u'coords': [[0], [0]], u'values': [1]}, False)
+
+..
+    >>> request.GET = {'dimensions': 'instrument_name', 'format': 'sparse'}
+    >>> data = simplejson.loads(measures_json(request, cube=c, limit=1).content)
+    >>> data['dimensions'], data['axes'][0]['count'], data['totals']['axes'], data['cells']['values']
+    ([u'instrument_name'], 2, [[1]], [1])
+    >>> request.GET = {'format': 'xml'}
+    >>> response = measures_json(request, cube=c, dimensions=['lastname'])
+    >>> response.status_code, response.content
+    (400, "invalid format 'xml'")
+    >>> request.GET = {'dimensions': 'lastname,nonexistent'}
+    >>> response = measures_json(request, cube=c)
+    >>> response.status_code, response.content
+    (400, "invalid dimension 'nonexistent'")
+    >>> grouped_c = GroupedMusicianCube(Musician.objects.all())
+    >>> request.GET = {'offsets': '1,0', 'limits': '2,1', 'totals': '0'}
+    >>> settings.DEBUG = True ; reset_queries()
+    >>> data = simplejson.loads(measures_json(request, cube=grouped_c, dimensions=['firstname', 'instrument_name']).content)
+    >>> [query['sql'].count(' IN ') for query in connection.queries if 'GROUP BY' in query['sql']]
+    [2]
+    >>> data['cells'] == [row[0:1] for row in grouped_c.measures_list('firstname', 'instrument_name')[1:3]]
+    True
+    >>> settings.DEBUG = False
+
+..
+    >>> c = MusicianCube(Musician.objects.all())
+
+The page of the table to render can be sent along with the request, as GET parameters *col_offset*, *col_limit*, *row_offset* and *row_limit* :
+
+    >>> request.GET = {'col_offset': '3', 'row_limit': '1'}
+    >>> response = table_from_cube(request, cube=c, dimensions=['firstname', 'instrument_name'])
+    >>> len(re.findall('<th>', str(response))), len(re.findall('<td>', str(response)))
+    (6, 6)
+
+The limits passed as kwargs to the view are the maximum size of a page :
+
+    >>> request.GET = {'col_limit': '1000'}
+    >>> response = table_from_cube(request, cube=c, dimensions=['firstname', 'instrument_name'], col_limit=2)
+    >>> len(re.findall('<th>', str(response))), len(re.findall('<td>', str(response)))
+    (8, 12)
+
+With *cache_timeout*, the rendered table is cached (see :mod:`cache`) :
+
+    >>> request.GET = {}
+    >>> response = table_from_cube(request, cube=c, dimensions=['firstname', 'instrument_name'], cache_timeout=600)
+    >>> settings.DEBUG = True ; reset_queries()
+    >>> response = table_from_cube(request, cube=c, dimensions=['firstname', 'instrument_name'], cache_timeout=600)
+    >>> len(connection.queries), len(re.findall('<td>', str(response)))
+    (0, 24)
+
+..
+    >>> settings.DEBUG = False
+
+With *conditional*, the response has an ETag that only changes with the data of the cube. When the client already has the table, the response is a *304 Not Modified*, and the table is not calculated :
+
+    >>> request.method = 'GET'
+    >>> response = table_from_cube(request, cube=c, dimensions=['firstname', 'instrument_name'], conditional=True)
+    >>> request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+    >>> settings.DEBUG = True ; reset_queries()
+    >>> response = table_from_cube(request, cube=c, dimensions=['firstname', 'instrument_name'], conditional=True)
+    >>> response.status_code, len(connection.queries)
+    (304, 0)
+    >>> trumpet.save()
+    >>> table_from_cube(request, cube=c, dimensions=['firstname', 'instrument_name'], conditional=True).status_code
+    200
+
+..
+    >>> settings.DEBUG = False
+    >>> del request.META['HTTP_IF_NONE_MATCH']
+
+    ----- Last-Modified
+    >>> song_cube = SongCube(Song.objects.all())
+    >>> response = table_from_cube(request, cube=song_cube, dimensions=['auth_name', 'date_year'], last_modified_field='release_date')
+    >>> response['Last-Modified']
+    'Tue, 21 Jan 1969 00:00:00 GMT'
+    >>> request.META['HTTP_IF_MODIFIED_SINCE'] = response['Last-Modified']
+    >>> table_from_cube(request, cube=song_cube, dimensions=['auth_name', 'date_year'], last_modified_field='release_date').status_code
+    304
+    >>> del request.META['HTTP_IF_MODIFIED_SINCE']
+
 """
 
 from django.db import models
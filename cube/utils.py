@@ -186,10 +186,23 @@ class odict(dict):
     >>> d
     odict.odict([('a', 'b'), ('c', 'd'), ('foo', 'bar'), ('spam', [])])
 
+    Pickling keeps the order of the keys, with all the protocols:
+
+    >>> import pickle
+    >>> d.reverse()
+    >>> [pickle.loads(pickle.dumps(d, protocol)).keys() for protocol in (0, 2)]
+    [['spam', 'foo', 'c', 'a'], ['spam', 'foo', 'c', 'a']]
+
     .. _proposal: http://thread.gmane.org/gmane.comp.python.devel/95316
     .. _ordereddict: http://www.xs4all.nl/~anthon/Python/ordereddict/
     """
 
+    def __new__(cls, *args, **kwargs):
+        d = dict.__new__(cls, *args, **kwargs)
+        #unpickling sets the items before calling *__setstate__*
+        d._keys = []
+        return d
+
     def __init__(self, *args, **kwargs):
         dict.__init__(self)
         self._keys = []
@@ -220,7 +233,7 @@ class odict(dict):
 
     def __setstate__(self, d):
         self._keys = d['keys']
-        dict.update(d['items'])
+        dict.update(self, d['items'])
 
     def __reversed__(self):
         return reversed(self._keys)
@@ -1,14 +1,37 @@
-from django.shortcuts import render_to_response
+import csv
+from cStringIO import StringIO
+from datetime import date, datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Model
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils import simplejson
+from django.utils.encoding import force_unicode, smart_str
+from django.views.decorators.http import condition
+
+from cache import cached_fragment, table_etag
+from parallel import close_connections
+from query import SparseMeasures
 
-def table_from_cube(request, cube=None, dimensions=None, extra_context={}, template_name='table_from_cube.html'):
+def table_from_cube(request, cube=None, dimensions=None, extra_context={}, template_name='table_from_cube.html', col_limit=None, row_limit=None, cache_timeout=None, conditional=False, last_modified_field=None):
     """
     A view that renders *template_name* with a context built with :func:`cube.models.Cube.table_helper`.
 
     Kwargs:
-    
+
         cube(Cube). The cube to build the table from.
         dimensions(list). A list ["dimension1", "dimension2"], where "dimension1" is the name of the dimension that will be used for columns, "dimension2" the name of the dimension for rows.
+        col_limit(int). The maximum number of columns in a page of the table. Defaults to None, i.e. no limit.
+        row_limit(int). The maximum number of rows in a page of the table. Defaults to None, i.e. no limit.
+        cache_timeout(int). If given, the rendered table is cached for *cache_timeout* seconds, or until the data of the cube changes (see :mod:`cube.cache`). Defaults to None, i.e. no caching.
+        conditional(bool). If True, the response has an ETag built from the data versions of the cube's models (see :func:`cube.cache.table_etag`), and a request with a matching *If-None-Match* header gets a *304 Not Modified* response, without the table being calculated. Defaults to False.
+        last_modified_field(str). If given, the response has a *Last-Modified* header, taken from the maximum of this field in the cube's base queryset, and *If-Modified-Since* is honored the same way. Note that deletions don't change this maximum. Defaults to None.
+
+    The page of the table to render is read from the GET parameters *col_offset*, *col_limit*, *row_offset* and *row_limit* of the request. The limits sent with the request cannot be greater than *col_limit* and *row_limit*.
+
+    .. note:: The cached table only depends on the cube, the dimensions, the template, the page of the table and *extra_context*. Don't cache it if the template uses other variables from the request.
     """
     if not cube:
         raise TypeError('You must provide a cube.')
@@ -16,8 +39,247 @@ def table_from_cube(request, cube=None, dimensions=None, extra_context={}, templ
     if not dimensions or None in dimensions:
         raise TypeError('You must provide two dimensions, either by passing them as kwargs, or by sending them along with the request.')
 
-    context = cube.table_helper(*dimensions)
-    context["cube"] = cube
-    context.update(extra_context)
+    window = _get_table_window(request, col_limit, row_limit)
+    #the values, other than the cube's, that the rendered table depends on
+    extra = (sorted(window.items()), sorted(extra_context.items()))
+
+    def render():
+        context = cube.table_helper(*dimensions, **window)
+        context["cube"] = cube
+        context.update(extra_context)
+        return render_to_string(template_name, context, context_instance=RequestContext(request))
+
+    def view(request):
+        if cache_timeout is None:
+            return HttpResponse(render())
+        return HttpResponse(cached_fragment(cube, dimensions, template_name, render, cache_timeout, extra))
+
+    if not conditional and last_modified_field is None:
+        return view(request)
+
+    #the validators are calculated before the table, so that a 304 response doesn't calculate it at all
+    etag = conditional and table_etag(cube, dimensions, template_name, extra) or None
+    if last_modified_field is not None:
+        last_modified = cube.queryset.aggregate(last_modified=Max(last_modified_field))['last_modified']
+        if isinstance(last_modified, date) and not isinstance(last_modified, datetime):
+            last_modified = datetime(last_modified.year, last_modified.month, last_modified.day)
+    else:
+        last_modified = None
+    return condition(etag_func=lambda request: etag, last_modified_func=lambda request: last_modified)(view)(request)
+
+def measures_export(request, cube=None, dimensions=None, format='csv', filename=None, batch_size=100):
+    """
+    A view that exports the measures of a cube as a file, built with :func:`cube.models.Cube.measures_iter`. The file is streamed : the rows are written in the response as soon as their batch of measures is calculated, and the values of the first dimension are read from the database as they are needed. 
+
+    Kwargs:
+
+        cube(Cube). The cube to export the measures from.
+        dimensions(list). A list ["dimension1", ..., "dimensionN"] of the names of the dimensions to export.
+        format(str). The format of the file, 'csv' or 'ndjson' (one JSON object per line). Can be overriden with the GET parameter *format* of the request.
+        filename(str). If given, the response is sent as an attachment with this file name.
+        batch_size(int). The number of measures calculated together.
+
+    Model instances are exported as their primary key. An unknown format gets a *400 Bad Request* response.
+
+    The response is streamed after the request's database connections were closed, so the connections opened while streaming are closed at the end of the file.
+
+    .. note:: Some middlewares (for example *GZipMiddleware*, or *CommonMiddleware* with *USE_ETAGS*) read the whole response, and therefore cancel the streaming.
+    """
+    if not cube:
+        raise TypeError('You must provide a cube.')
+
+    if not dimensions or None in dimensions:
+        raise TypeError('You must provide the dimensions to export.')
+
+    format = request.GET.get('format', format)
+    if format not in ('csv', 'ndjson'):
+        return HttpResponseBadRequest("invalid export format '%s'" % format)
+    measures = cube.measures_iter(*dimensions, **{'batch_size': batch_size})
+    if format == 'csv':
+        response = HttpResponse(_closing(_csv_lines(dimensions, measures)), mimetype='text/csv')
+    else:
+        response = HttpResponse(_closing(_ndjson_lines(dimensions, measures)), mimetype='application/x-ndjson')
+
+    if filename:
+        response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
+
+def measures_json(request, cube=None, dimensions=None, format='dense', limit=None, totals=True):
+    """
+    A view that returns the measures of a cube as JSON, for rendering the cube client-side. The JSON object has the following keys :
+
+        - dimensions: the names of the dimensions, as *['dimension1', ..., 'dimensionN']*
+        - axes: for each dimension, *{'values': [val1, ..., valN], 'labels': [label1, ..., labelN], 'offset': offset, 'count': count}*, where the labels are the :meth:`Dimension.pretty_constraint` of the values, and *count* is the total number of values, regardless of the pagination.
+        - measure_none: the measure of the empty cells.
+        - cells: with the format 'dense', the measures as nested lists, structured like :meth:`cube.models.Cube.measures_list`. With the format 'sparse', only the cells that are not empty, as *{'coords': [[i1, ..., iN], ..., [k1, ..., kN]], 'values': [measure1, ..., measureN]}*, where *coords* contains, for each dimension, the indexes of the cells' values in the axis.
+        - totals: *{'axes': [[total1, ..., totalN], ...], 'overall': overall}*, where *axes* contains, for each dimension, the measures on the subcubes with this dimension only constrained to each value of the axis. Only if *totals* is True.
+
+    Kwargs:
+
+        cube(Cube). The cube to get the measures from.
+        dimensions(list). A list ["dimension1", ..., "dimensionN"] of the names of the dimensions. Can be overriden with the GET parameter *dimensions*, as a comma-separated list.
+        format(str). 'dense' or 'sparse'. Can be overriden with the GET parameter *format*.
+        limit(int). The maximum number of values in a page of each axis. Defaults to None, i.e. no limit.
+        totals(bool). Whether to calculate the totals. Can be overriden with the GET parameter *totals* ('0' or '1').
+
+    The page to return is read from the GET parameters *offsets* and *limits*, as comma-separated lists with one integer for each dimension. The limits sent with the request cannot be greater than *limit*.
+
+    An invalid format or dimension gets a *400 Bad Request* response.
+
+    The arrays are kept compact : all the measures are calculated with the batched engine (one grouped query if the cube has an *aggregate*), and model instances are sent as their primary key.
+    """
+    if not cube:
+        raise TypeError('You must provide a cube.')
+
+    if 'dimensions' in request.GET:
+        dimensions = [dim_name for dim_name in request.GET['dimensions'].split(',') if dim_name]
+    if not dimensions or None in dimensions:
+        raise TypeError('You must provide the dimensions, either by passing them as kwargs, or by sending them along with the request.')
+    dimensions = [str(dim_name) for dim_name in dimensions]
+    for dim_name in dimensions:
+        if dim_name not in cube._meta.dim_names:
+            return HttpResponseBadRequest("invalid dimension '%s'" % dim_name)
+
+    format = request.GET.get('format', format)
+    if format not in ('dense', 'sparse'):
+        return HttpResponseBadRequest("invalid format '%s'" % format)
+    totals = bool(_get_int_param(request, 'totals', int(bool(totals))))
+
+    #the page of each axis
+    offsets = _get_int_list_param(request, 'offsets', len(dimensions), 0)
+    limits = _get_int_list_param(request, 'limits', len(dimensions), limit)
+    full_axes = cube._measures_axes(dimensions)
+    axes = []
+    for axis, offset, axis_limit in zip(full_axes, offsets, limits):
+        if limit is not None and (axis_limit is None or axis_limit > limit):
+            axis_limit = limit
+        stop = offset + axis_limit if axis_limit is not None else None
+        axes.append(axis[offset:stop])
+
+    cells = [cell for cell in cube._measures_cells(dimensions, axes) if cell[1] != cube.measure_none]
+    cells.sort()
+    sparse = SparseMeasures(dimensions, axes, cells, measure_none=cube.measure_none)
+
+    data = {
+        'dimensions': dimensions,
+        'axes': [{
+            'values': [_export_value(value) for value in axis],
+            'labels': [force_unicode(label) for label in cube._bound_dimension(dim_name).pretty_constraints(axis)],
+            'offset': offset,
+            'count': len(full_axis),
+        } for dim_name, axis, full_axis, offset in zip(dimensions, axes, full_axes, offsets)],
+        'measure_none': cube.measure_none,
+    }
+    if format == 'dense':
+        data['cells'] = sparse.to_measures_list()
+    else:
+        data['cells'] = {'coords': [coord.tolist() for coord in sparse.coords], 'values': sparse.values}
+    if totals:
+        data['totals'] = {'axes': [_axis_totals(cube, dim_name, axis) for dim_name, axis in zip(dimensions, axes)], 'overall': cube.measure()}
 
-    return render_to_response(template_name, context, context_instance=RequestContext(request))
+    return HttpResponse(simplejson.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')), mimetype='application/json')
+
+def _axis_totals(cube, dim_name, axis):
+    """
+    Returns:
+        list. The measures of *cube* on the subcubes with *dim_name* constrained to each value of *axis*.
+    """
+    axis_totals = [cube.measure_none] * len(axis)
+    for indexes, measure in cube._measures_cells([dim_name], [axis]):
+        axis_totals[indexes[0]] = measure
+    return axis_totals
+
+def _export_value(value):
+    """
+    Returns:
+        object. The value to write in an export file for *value*.
+    """
+    if isinstance(value, Model):
+        return value.pk
+    return value
+
+def _closing(lines):
+    """
+    Returns:
+        iterator. An iterator on *lines*, that closes the database connections of the thread when it is exhausted or closed.
+    """
+    try:
+        for line in lines:
+            yield line
+    finally:
+        close_connections()
+
+def _csv_lines(dim_names, measures):
+    """
+    Returns:
+        iterator. An iterator on the lines of a CSV file, with one column per dimension in *dim_names* and a last column *measure*.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(list(dim_names) + ['measure'])
+    yield buffer.getvalue()
+    for measure_dict in measures:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([smart_str(_export_value(measure_dict[dim_name])) for dim_name in dim_names]\
+            + [smart_str(measure_dict['__measure'])])
+        yield buffer.getvalue()
+
+def _ndjson_lines(dim_names, measures):
+    """
+    Returns:
+        iterator. An iterator on the lines of a NDJSON file, with one object *{'dim_name1': val1, ..., 'measure': measure}* per line.
+    """
+    for measure_dict in measures:
+        line = dict([(dim_name, _export_value(measure_dict[dim_name])) for dim_name in dim_names])
+        line['measure'] = measure_dict['__measure']
+        yield simplejson.dumps(line, cls=DjangoJSONEncoder) + '\n'
+
+def _get_table_window(request, col_limit, row_limit):
+    """
+    Returns:
+        dict. The kwargs for :func:`cube.models.Cube.table_helper` that define the page of the table requested. Invalid values in the request are ignored.
+    """
+    window = {
+        'col_offset': _get_int_param(request, 'col_offset', 0),
+        'col_limit': _get_int_param(request, 'col_limit', col_limit),
+        'row_offset': _get_int_param(request, 'row_offset', 0),
+        'row_limit': _get_int_param(request, 'row_limit', row_limit),
+    }
+    #the request cannot ask for a bigger page than allowed
+    if col_limit is not None and window['col_limit'] > col_limit:
+        window['col_limit'] = col_limit
+    if row_limit is not None and window['row_limit'] > row_limit:
+        window['row_limit'] = row_limit
+    return window
+
+def _get_int_list_param(request, name, length, default):
+    """
+    Returns:
+        list. The GET parameter *name* of the request, as a comma-separated list of *length* positive integers. The missing or invalid integers are replaced with *default*.
+    """
+    values = request.GET.get(name, '').split(',')
+    values += [''] * (length - len(values))
+    int_list = []
+    for value in values[:length]:
+        try:
+            value = int(value)
+        except ValueError:
+            value = default
+        if value is not None and value < 0:
+            value = default
+        int_list.append(value)
+    return int_list
+
+def _get_int_param(request, name, default):
+    """
+    Returns:
+        int. The GET parameter *name* of the request as a positive integer, or *default* if the parameter is missing or invalid.
+    """
+    try:
+        value = int(request.GET[name])
+    except (KeyError, ValueError, TypeError):
+        return default
+    if value < 0:
+        return default
+    return value